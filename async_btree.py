@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+
+from main import open_data_file, open_tree
+
+GET = "get"
+PUT = "put"
+DELETE = "delete"
+RANGE = "range"
+
+
+class AsyncBTree:
+    # asyncio front end of a BTree: requests arriving in the same loop tick are split into
+    # waves of independent requests, the requests of one kind in a wave are applied as one
+    # sorted batch on a bounded thread pool, so the event loop never waits for node or record I/O
+    def __init__(self, tree, max_workers=4):
+        self.tree = tree
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.pending = []
+        self.worker = None
+        # counters
+        self.batches = 0
+        self.requests = 0
+
+    async def get(self, key):
+        # value of the key or None
+        return await self._submit(GET, key)
+
+    async def put(self, key, value):
+        # inserts the key, an existing key keeps its value as with BTree.insert
+        return await self._submit(PUT, key, value)
+
+    async def delete(self, key):
+        # True if the key was deleted
+        return await self._submit(DELETE, key)
+
+    async def range(self, lo, hi, include_values=False):
+        return await self._submit(RANGE, lo, hi, include_values)
+
+    async def close(self):
+        while self.worker is not None and not self.worker.done():
+            await self.worker
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.tree.close)
+        self.executor.shutdown()
+
+    def _submit(self, kind, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((kind, args, future))
+        if self.worker is None or self.worker.done():
+            self.worker = loop.create_task(self._run())
+        return future
+
+    async def _run(self):
+        while self.pending:
+            # let the rest of the tick queue its requests
+            await asyncio.sleep(0)
+            requests, self.pending = self.pending, []
+            for wave in split_waves(requests):
+                for kind in (PUT, DELETE, GET, RANGE):
+                    if kind in wave:
+                        await self._execute(wave[kind])
+
+    async def _execute(self, run):
+        kind = run[0][0]
+        loop = asyncio.get_running_loop()
+        self.batches += 1
+        self.requests += len(run)
+        try:
+            if kind == RANGE:
+                # scans are independent, a thread-safe tree runs them side by side, any other
+                # tree runs them one after another in a single job
+                if self.tree.latches is None:
+                    results = await loop.run_in_executor(self.executor, self._range_many, [args for _, args, _ in run])
+                else:
+                    results = await asyncio.gather(
+                        *(loop.run_in_executor(self.executor, self._range, *args) for _, args, _ in run))
+            else:
+                batch = getattr(self, f"_{kind}_many")
+                results = await loop.run_in_executor(self.executor, batch, [args for _, args, _ in run])
+        except Exception as error:
+            for _, _, future in run:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, _, future), result in zip(run, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _get_many(self, requests):
+        # nodes are read right after the descent, before the next batch may change them
+        found = self.tree.search_many(key for key, in requests)
+        values = {}
+        for key, (node, status) in found.items():
+            if status == "found":
+                values[key] = self.tree.read_from_main_file(node.offsets[bisect_left(node.keys, key)])
+        return [values.get(key) for key, in requests]
+
+    def _put_many(self, requests):
+        self.tree.insert_many(requests)
+        return [None] * len(requests)
+
+    def _delete_many(self, requests):
+        keys = [key for key, in requests]
+        deleted = set(self.tree.delete_many(keys))
+        # a repeated key is deleted by its first request only
+        results = []
+        for key in keys:
+            results.append(key in deleted)
+            deleted.discard(key)
+        return results
+
+    def _range(self, lo, hi, include_values):
+        return list(self.tree.range(lo, hi, include_values))
+
+    def _range_many(self, requests):
+        return [self._range(*args) for args in requests]
+
+
+def split_waves(requests):
+    # consecutive requests grouped by kind as long as no key is used by two kinds and no
+    # write falls into a scanned range, the kinds of a wave can then run in any order
+    wave = {}
+    kinds = {}
+    writes = []
+    scans = []
+    for request in requests:
+        kind, args, _ = request
+        if kind == RANGE:
+            lo, hi = args[0], args[1]
+            i = bisect_left(writes, lo)
+            conflict = i < len(writes) and writes[i] <= hi
+        else:
+            key = args[0]
+            conflict = kinds.get(key, kind) != kind or \
+                (kind != GET and any(lo <= key <= hi for lo, hi in scans))
+        if conflict:
+            yield wave
+            wave, kinds, writes, scans = {}, {}, [], []
+
+        wave.setdefault(kind, []).append(request)
+        if kind == RANGE:
+            scans.append((args[0], args[1]))
+        else:
+            kinds[args[0]] = kind
+            if kind != GET:
+                insort(writes, args[0])
+    if wave:
+        yield wave
+
+
+async def handle_client(tree, reader, writer):
+    # commands of one connection are answered in order, commands read before their
+    # answers are ready are batched with those of other clients
+    answers = asyncio.Queue()
+
+    async def answer():
+        while True:
+            response = await answers.get()
+            if response is None:
+                break
+            writer.write((await response + "\n").encode())
+            await writer.drain()
+
+    answering = asyncio.create_task(answer())
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.strip():
+            answers.put_nowait(asyncio.ensure_future(execute_command(tree, line.decode())))
+    answers.put_nowait(None)
+    await answering
+    writer.close()
+    await writer.wait_closed()
+
+
+async def execute_command(tree, command):
+    # "1;key;value" insert, "2;key" delete, "3;key" search
+    try:
+        fields = command.strip().split(';')
+        match fields[0]:
+            case '1':
+                _, key, value = fields
+                await tree.put(int(key), value)
+                return f"Inserted ({key}, {value})"
+            case '2':
+                _, key = fields
+                if await tree.delete(int(key)):
+                    return f"Deleted ({key})"
+                return f"Not found {key} in tree."
+            case '3':
+                _, key = fields
+                value = await tree.get(int(key))
+                if value is None:
+                    return f"Not found {key} in tree."
+                return f"Found ({key}, {value})"
+        return f"Unknown command: {command.strip()}"
+    except ValueError:
+        return f"Malformed command: {command.strip()}"
+
+
+async def serve(tree, host="127.0.0.1", port=8765, unix_path=None):
+    async def on_connect(reader, writer):
+        await handle_client(tree, reader, writer)
+
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(on_connect, unix_path)
+    else:
+        server = await asyncio.start_server(on_connect, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def run_server(args):
+    tree = AsyncBTree(open_tree(open_data_file(args.file)), args.workers)
+    try:
+        await serve(tree, args.host, args.port, args.unix)
+    finally:
+        await tree.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a B-tree over TCP or a Unix socket")
+    parser.add_argument("file", help="data file of the tree")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Unix socket path, used instead of TCP")
+    parser.add_argument("--workers", type=int, default=4)
+    try:
+        asyncio.run(run_server(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
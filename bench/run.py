@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from bench.workloads import WORKLOADS, Bench
+
+
+def run(sizes, ts, workloads, seed=0, directory=None, tree_options=None, layouts=None):
+    # every workload for every size, t and node layout, results as a JSON-serialisable dict
+    own_directory = directory is None
+    if own_directory:
+        directory = tempfile.mkdtemp(prefix="btree-bench-")
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    try:
+        for size in sizes:
+            for t in ts:
+                for layout in layouts or ["btree"]:
+                    bench = Bench(directory, size, t, seed, dict(tree_options or {}, layout=layout))
+                    for name in workloads:
+                        results.append(WORKLOADS[name](bench))
+    finally:
+        if own_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "config": {
+            "sizes": sizes,
+            "t": ts,
+            "layouts": layouts or ["btree"],
+            "workloads": workloads,
+            "seed": seed,
+            "tree_options": tree_options or {},
+            "python": platform.python_version(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run B-tree workloads and report their I/O as JSON")
+    parser.add_argument("--sizes", type=int_list, default=[1000, 10000], help="comma separated record counts")
+    parser.add_argument("--t", type=int_list, default=[4, 16], help="comma separated node capacities")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"comma separated subset of {', '.join(WORKLOADS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pool", type=int, default=128, help="buffer pool capacity in pages")
+    parser.add_argument("--policy", default="lru", help="buffer pool eviction policy")
+    parser.add_argument("--group-commit", type=int, default=1, help="operations per log fsync")
+    parser.add_argument("--codec", default="fixed", help="node page encoding: fixed, compact or compact-zlib")
+    parser.add_argument("--page-size", type=int, help="page size in bytes, t is then the number of keys that fit")
+    parser.add_argument("--layout", default="btree", help="comma separated node layouts: btree, bplus")
+    parser.add_argument("--prefetch", action="store_true", help="read ahead the pages of scans and lookup batches")
+    parser.add_argument("--bloom", type=float, help="keep a Bloom filter of the keys with this false positive rate")
+    parser.add_argument("--directory", help="keep data and trees in this directory")
+    parser.add_argument("--output", help="write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    workloads = args.workloads.split(',')
+    unknown = [name for name in workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+    options = {"pool_capacity": args.pool, "pool_policy": args.policy, "group_commit_ops": args.group_commit,
+               "codec": args.codec, "page_size": args.page_size, "prefetch": args.prefetch}
+    if args.bloom is not None:
+        options.update(bloom=True, bloom_fp_rate=args.bloom)
+    ts = args.t if args.page_size is None else [None]
+    report = json.dumps(run(args.sizes, ts, workloads, args.seed, args.directory, options, args.layout.split(',')),
+                        indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + "\n")
+    else:
+        print(report)
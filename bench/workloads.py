@@ -0,0 +1,180 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import time
+
+from btree import BTree
+from data_generator import generate_records
+from record_file import convert_text_file
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Bench:
+    # data set of one size and the trees built from it, every workload gets
+    # its own copy of the record file and a fresh index, t None takes it from the page size
+    def __init__(self, directory, size, t, seed=0, tree_options=None):
+        self.directory = directory
+        self.size = size
+        self.t = t
+        self.seed = seed
+        self.tree_options = tree_options or {}
+        self.rng = random.Random(seed)
+
+        text_path = os.path.join(directory, f"data_{size}_{seed}.txt")
+        self.record_path = os.path.join(directory, f"data_{size}_{seed}.rec")
+        if not os.path.exists(self.record_path):
+            random.seed(seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate_records(text_path, size)
+            convert_text_file(text_path, self.record_path)
+        self.records = []
+        with open(text_path) as file:
+            for line in file:
+                _, key, value = line.split(':')
+                self.records.append((int(key), value.strip()))
+
+    def new_tree(self, name, loaded=False):
+        # empty tree with an empty record file or a bulk-loaded copy of the data set
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        data_path = os.path.join(path, "data.rec")
+        if loaded:
+            shutil.copyfile(self.record_path, data_path)
+            tree = BTree(t=self.t, index_path=os.path.join(path, "index.idx"), **self.tree_options)
+            tree.bulk_load(data_path)
+        else:
+            tree = BTree(data_path, t=self.t, index_path=os.path.join(path, "index.idx"), **self.tree_options)
+        return tree
+
+    def measure(self, name, tree, operation, arguments, operations=None):
+        # times every call of the operation, the final checkpoint counts towards
+        # the total time and the I/O but not towards the latencies
+        counters = (tree.read_operations, tree.write_operations, tree.bytes_read, tree.bytes_written,
+                    tree.wal.bytes_written)
+        latencies = []
+        start = time.perf_counter()
+        for argument in arguments:
+            operation_start = time.perf_counter()
+            operation(argument)
+            latencies.append(time.perf_counter() - operation_start)
+        tree.flush()
+        seconds = time.perf_counter() - start
+        reads, writes, bytes_read, bytes_written, wal_bytes = (
+            now - before for now, before in zip(
+                (tree.read_operations, tree.write_operations, tree.bytes_read, tree.bytes_written,
+                 tree.wal.bytes_written), counters))
+
+        operations = len(latencies) if operations is None else operations
+        result = {
+            "workload": name,
+            "size": self.size,
+            "t": tree.t,
+            "layout": tree.layout,
+            "operations": operations,
+            "seconds": seconds,
+            "ops_per_sec": operations / seconds if seconds else None,
+            "p50_ms": None if operations != len(latencies) else 1000 * percentile(latencies, 0.5),
+            "p99_ms": None if operations != len(latencies) else 1000 * percentile(latencies, 0.99),
+            "node_reads_per_op": reads / operations,
+            "node_writes_per_op": writes / operations,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "wal_bytes_written": wal_bytes,
+            "index_file_bytes": os.path.getsize(tree.index_path),
+            "data_file_bytes": os.path.getsize(tree.main_file_path),
+            "buffer_hits": tree.buffer_pool.hits,
+            "buffer_misses": tree.buffer_pool.misses,
+            "prefetched_pages": tree.prefetcher.pages if tree.prefetcher is not None else 0,
+        }
+        # after the counters, the walk reads every node
+        result["height"] = tree.stats()["height"]
+        tree.close()
+        return result
+
+    def sample(self, count):
+        return self.rng.sample(self.records, min(count, len(self.records)))
+
+
+def bulk_load(bench):
+    path = os.path.join(bench.directory, "bulk_load")
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    data_path = os.path.join(path, "data.rec")
+    shutil.copyfile(bench.record_path, data_path)
+    tree = BTree(t=bench.t, index_path=os.path.join(path, "index.idx"), **bench.tree_options)
+    # one timed call, throughput is reported per loaded record
+    return bench.measure("bulk_load", tree, tree.bulk_load, [data_path], operations=len(bench.records))
+
+
+def random_insert(bench):
+    tree = bench.new_tree("random_insert")
+    records = bench.records[:]
+    bench.rng.shuffle(records)
+    return bench.measure("random_insert", tree, lambda record: tree.insert(*record), records)
+
+
+def sequential_insert(bench):
+    tree = bench.new_tree("sequential_insert")
+    return bench.measure("sequential_insert", tree, lambda record: tree.insert(*record), sorted(bench.records))
+
+
+def lookup(bench):
+    tree = bench.new_tree("lookup", loaded=True)
+
+    def get(key):
+        node, status = tree.search(key)
+        if status == "found":
+            tree.read_from_main_file(node.offsets[node.keys.index(key)])
+
+    # every second key is missing from the tree
+    keys = [key if i % 2 else -key for i, (key, _) in enumerate(bench.sample(bench.size))]
+    return bench.measure("lookup", tree, get, keys)
+
+
+def delete_heavy(bench):
+    tree = bench.new_tree("delete_heavy", loaded=True)
+    # removes 80% of the keys in random order
+    keys = [key for key, _ in bench.sample(bench.size * 4 // 5)]
+    return bench.measure("delete_heavy", tree, tree.delete, keys)
+
+
+def update(bench):
+    tree = bench.new_tree("update", loaded=True)
+
+    # option 5 of the menu
+    def replace(record):
+        key, value = record
+        tree.delete(key)
+        tree.insert(key, value + "*")
+
+    return bench.measure("update", tree, replace, bench.sample(bench.size // 2))
+
+
+def range_scan(bench, width=100):
+    tree = bench.new_tree("range_scan", loaded=True)
+    # scans of about width keys each, keys are spread over 10 * size values
+    starts = [key for key, _ in bench.sample(max(1, bench.size // 100))]
+    return bench.measure("range_scan", tree,
+                         lambda lo: sum(1 for _ in tree.range(lo, lo + 10 * width, include_values=True)), starts)
+
+
+WORKLOADS = {
+    "bulk_load": bulk_load,
+    "random_insert": random_insert,
+    "sequential_insert": sequential_insert,
+    "lookup": lookup,
+    "delete_heavy": delete_heavy,
+    "update": update,
+    "range_scan": range_scan,
+}
@@ -0,0 +1,86 @@
+import math
+import os
+import struct
+
+MAGIC = b"BTBLM\0\0\1"
+# magic, bits, hash functions, keys the filter was sized for, keys added, root and pages of the index it was saved with
+HEADER = struct.Struct("<8sQIQQqq")
+MASK = 0xFFFFFFFFFFFFFFFF
+# smallest number of keys a growing filter is sized for
+MIN_CAPACITY = 1024
+
+
+def mix(key):
+    # splitmix64 finalizer, spreads consecutive keys over the whole range
+    z = (key + 0x9E3779B97F4A7C15) & MASK
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EB & MASK
+    return z ^ (z >> 31)
+
+
+class BloomFilter:
+    # set of keys with false positives but no false negatives, deleted keys stay in it
+    # until the filter is rebuilt
+    def __init__(self, bits, hashes, capacity):
+        self.bits = bits
+        self.hashes = hashes
+        self.capacity = capacity
+        self.count = 0
+        self.array = bytearray((bits + 7) // 8)
+
+    @staticmethod
+    def for_keys(capacity, fp_rate, bits=None):
+        # filter for the number of keys at the false positive rate, with a fixed number of
+        # bits the capacity is the number of keys the rate holds for
+        if not 0 < fp_rate < 1:
+            raise ValueError("False positive rate has to be in (0, 1)")
+        if bits is None:
+            bits = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        else:
+            capacity = max(1, int(bits * math.log(2) ** 2 / -math.log(fp_rate)))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        return BloomFilter(bits, hashes, capacity)
+
+    def _positions(self, key):
+        # double hashing, both halves of one 64-bit hash
+        h = mix(key & MASK)
+        h1 = h & 0xFFFFFFFF
+        h2 = h >> 32 | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for position in self._positions(key):
+            if not self.array[position >> 3] & 1 << (position & 7):
+                return False
+        return True
+
+    def save(self, path, root, pages):
+        # written next to the index and swapped in whole
+        with open(path + ".tmp", 'wb') as file:
+            file.write(HEADER.pack(MAGIC, self.bits, self.hashes, self.capacity, self.count, root, pages))
+            file.write(self.array)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path, root, pages):
+        # saved filter or None if it is missing, damaged or was saved with another state of the index
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            return None
+        magic, bits, hashes, capacity, count, saved_root, saved_pages = HEADER.unpack_from(data)
+        if magic != MAGIC or (saved_root, saved_pages) != (root, pages) or len(data) != HEADER.size + (bits + 7) // 8:
+            return None
+        bloom = BloomFilter(bits, hashes, capacity)
+        bloom.count = count
+        bloom.array[:] = data[HEADER.size:]
+        return bloom
@@ -1,29 +1,56 @@
 import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager, nullcontext
+
+from bloom import MIN_CAPACITY, BloomFilter
+from buffer_pool import BufferPool
+from bulk_load import TreePlan, read_records, sort_records, sort_text_file
+from codec import CODECS, PAGE_HEADER, capacity, decode_node, encode_node
+from latches import ROOT, LatchTable
+from pager import Pager
+from prefetch import Prefetcher
+from record_file import RECORD_HEADER, RecordFile
+from snapshot import Snapshot
+from wal import WriteAheadLog
+
+# t, is_leaf, number of keys, offsets and children, next leaf of a B+ tree
+NODE_HEADER = struct.Struct("<i?IIIq")
+# page size of compact nodes when only the codec is given
+DEFAULT_PAGE_SIZE = 4096
+# node layouts, the position in the tuple is stored in the superblock: a B-tree keeps records
+# in every node, a B+ tree only in leaves chained in key order
+LAYOUTS = ("btree", "bplus")
+
 
 class BTreeNode:
-    def __init__(self, t, index, ancestor=None, is_leaf=True):
+    __slots__ = ("t", "index", "keys", "offsets", "children", "is_leaf", "overflow", "next", "__weakref__")
+
+    def __init__(self, t, index, is_leaf=True):
         self.t = t  # Max number of keys in one node
         self.index = index
-        self.keys = []
-        self.offsets = []
-        self.children = []
-        self.ancestor = ancestor
+        self.keys = array('q')
+        self.offsets = array('q')
+        self.children = array('q')
         self.is_leaf = is_leaf
+        # pages a compact node continues on when it does not fit its own page
+        self.overflow = []
+        # next leaf in key order of a B+ tree, -1 for the last one
+        self.next = -1
 
     @staticmethod
-    def get_node_sibling(node, ancestor_node, btree):
+    def get_node_sibling(ancestor_node, position, btree):
+        # neighbours of the child at the position, the ancestor is taken from the descent path
         if ancestor_node is None:
             return None, None
-        if len(ancestor_node.children) == 1:
-            return None, None
-
-        this_index = ancestor_node.children.index(node.index)
-        if this_index == 0:
-            return None, BTree.read_node_from_drive(btree, ancestor_node.children[this_index + 1])
-        elif this_index == len(ancestor_node.children) - 1:
-            return BTree.read_node_from_drive(btree, ancestor_node.children[this_index - 1]), None
-        else:
-            return BTree.read_node_from_drive(btree, ancestor_node.children[this_index - 1]), BTree.read_node_from_drive(btree, ancestor_node.children[this_index + 1])
+        left, right = None, None
+        if position > 0:
+            left = BTree.read_node_for_write(btree, ancestor_node.children[position - 1])
+        if position < len(ancestor_node.children) - 1:
+            right = BTree.read_node_for_write(btree, ancestor_node.children[position + 1])
+        return left, right
 
     @staticmethod
     def compensation_insert(left, right, node, ancestor_node, middle_index, btree):
@@ -41,176 +68,508 @@ class BTreeNode:
 
     @staticmethod
     def compensation_delete(left, right, node, ancestor_node, middle_index, btree):
+        # siblings holding together at least t keys are too big to merge, so they are evened out
         if left is None and right is None:
             return False
-        if right is not None and len(right.keys) > right.t // 2 and len(right.keys) + len(node.keys) > right.t:
+        if right is not None and len(right.keys) > right.t // 2 and len(right.keys) + len(node.keys) >= right.t:
             BTreeNode.compensate(node, right, ancestor_node, middle_index + 1, btree, operation="delete")
             return True
-        if left is not None and len(left.keys) > left.t // 2 and len(left.keys) + len(node.keys) > left.t:
+        if left is not None and len(left.keys) > left.t // 2 and len(left.keys) + len(node.keys) >= left.t:
             BTreeNode.compensate(left, node, ancestor_node, middle_index, btree, operation="delete")
             return True
         return False
 
     @staticmethod
     def compensate(left, right, ancestor, middle_index, btree, operation="insert"):
-        keys = []
-        offsets = []
-        children = []
-
-        split_index = left.t if operation == "insert" else left.t // 2
-        if operation == "delete" and split_index % 2 == 1:
-            split_index += 1
+        if btree.tracer is not None:
+            start = time.perf_counter()
+        keys = array('q')
+        offsets = array('q')
+        children = array('q')
 
-        # add items in right order
+        # add items in right order, B+ leaves do not take the separator
+        leaves = btree.bplus and left.is_leaf
         keys.extend(left.keys)
         offsets.extend(left.offsets)
         children.extend(left.children)
-        keys.append(ancestor.keys[middle_index])
-        offsets.append(ancestor.offsets[middle_index])
+        if not leaves:
+            keys.append(ancestor.keys[middle_index])
+        if not btree.bplus:
+            offsets.append(ancestor.offsets[middle_index])
         keys.extend(right.keys)
         offsets.extend(right.offsets)
         children.extend(right.children)
 
+        # insert fills the left page, delete splits the keys evenly
+        split_index = left.t if operation == "insert" else len(keys) // 2
+
         # fill left page
         left.keys = keys[:split_index]
         left.offsets = offsets[:split_index]
         left.children = children[:split_index + 1]
 
-        # fill middle index
+        # fill middle index, a B+ leaf keeps it as its first key
         ancestor.keys[middle_index] = keys[split_index]
-        ancestor.offsets[middle_index] = offsets[split_index]
+        if not btree.bplus:
+            ancestor.offsets[middle_index] = offsets[split_index]
 
         # fill right page
-        right.keys = keys[split_index + 1:]
-        right.offsets = offsets[split_index + 1:]
+        right_start = split_index if leaves else split_index + 1
+        right.keys = keys[right_start:]
+        right.offsets = offsets[right_start:]
         right.children = children[split_index + 1:]
 
         # save modified modes
         BTree.write_node_to_drive(btree, left)
         BTree.write_node_to_drive(btree, right)
         BTree.write_node_to_drive(btree, ancestor)
+        if btree.tracer is not None:
+            btree.tracer.record("compensate", time.perf_counter() - start)
 
     @staticmethod
-    def split(node, btree):
+    def split(path, btree):
+        # path holds [node, position of the next node] from the root down to the split node
+        node = path[-1][0]
         # check if node has to be divided
         if len(node.keys) <= node.t:
             return
+        if btree.tracer is not None:
+            start = time.perf_counter()
 
         # Create a new node
-        new_node = BTreeNode(node.t, btree.index_for_node, ancestor=node.ancestor, is_leaf=node.is_leaf)
-        btree.index_for_node += 1
+        new_node = BTreeNode(node.t, btree.allocate_node_index(), is_leaf=node.is_leaf)
 
-        # get middle item
+        # get middle item, a B+ leaf keeps it as the first key of the new leaf
+        leaves = btree.bplus and node.is_leaf
         middle_index = len(node.keys) // 2
         middle_key = node.keys[middle_index]
-        middle_offset = node.offsets[middle_index]
+        middle_offset = None if btree.bplus else node.offsets[middle_index]
 
         # move right items to new node
-        new_node.keys = node.keys[middle_index + 1:]
-        new_node.offsets = node.offsets[middle_index + 1:]
+        right_start = middle_index if leaves else middle_index + 1
+        new_node.keys = node.keys[right_start:]
+        new_node.offsets = node.offsets[right_start:]
 
         # if node is not a leaf, move children to a new node
         if not node.is_leaf:
             new_node.children = node.children[middle_index + 1:]
-            for child in new_node.children:
-                child_node = btree.read_node_from_drive(child)
-                child_node.ancestor = new_node.index
-                btree.write_node_to_drive(child_node)
 
         # cut moved data
         node.keys = node.keys[:middle_index]
         node.offsets = node.offsets[:middle_index]
         if not node.is_leaf:
             node.children = node.children[:middle_index + 1]
+        if leaves:
+            # the new leaf follows the split one in the chain
+            new_node.next = node.next
+            node.next = new_node.index
 
         # create new root
-        if node.ancestor is None:
-            new_root = BTreeNode(node.t, btree.index_for_node, is_leaf=False)
-            btree.index_for_node += 1
-            new_root.keys = [middle_key]
-            new_root.offsets = [middle_offset]
-            new_root.children = [node.index, new_node.index]
-            node.ancestor = new_root.index
-            new_node.ancestor = new_root.index
+        if len(path) == 1:
+            new_root = BTreeNode(node.t, btree.allocate_node_index(), is_leaf=False)
+            new_root.keys = array('q', [middle_key])
+            if not btree.bplus:
+                new_root.offsets = array('q', [middle_offset])
+            new_root.children = array('q', [node.index, new_node.index])
             btree.root = new_root.index
             btree.write_node_to_drive(new_root)
             btree.write_node_to_drive(node)
             btree.write_node_to_drive(new_node)
+            if btree.tracer is not None:
+                btree.tracer.record("split", time.perf_counter() - start)
             return
 
         # move middle key to ancestor node
-        ancestor = btree.read_node_from_drive(node.ancestor)
-        insert_position = 0
-        while insert_position < len(ancestor.keys) and ancestor.keys[insert_position] < middle_key:
-            insert_position += 1
+        ancestor, insert_position = path[-2]
 
         ancestor.keys.insert(insert_position, middle_key)
-        ancestor.offsets.insert(insert_position, middle_offset)
+        if not btree.bplus:
+            ancestor.offsets.insert(insert_position, middle_offset)
         ancestor.children.insert(insert_position + 1, new_node.index)
 
-        new_node.ancestor = ancestor.index
         btree.write_node_to_drive(node)
         btree.write_node_to_drive(new_node)
         btree.write_node_to_drive(ancestor)
-        BTreeNode.split(ancestor, btree)
+        # a split of the ancestor is timed on its own
+        if btree.tracer is not None:
+            btree.tracer.record("split", time.perf_counter() - start)
+        BTreeNode.split(path[:-1], btree)
 
     @staticmethod
     def merge(left, right, ancestor, middle_index, btree):
         if left is None or right is None or ancestor is None:
             return
+        if btree.tracer is not None:
+            start = time.perf_counter()
 
-        # move key from ancestor to new node
-        left.keys.append(ancestor.keys[middle_index])
-        left.offsets.append(ancestor.offsets[middle_index])
+        # move key from ancestor to new node, merged B+ leaves drop it
+        leaves = btree.bplus and left.is_leaf
+        if not leaves:
+            left.keys.append(ancestor.keys[middle_index])
+        if not btree.bplus:
+            left.offsets.append(ancestor.offsets[middle_index])
 
         # add keys and children from right node to left node
         left.keys.extend(right.keys)
         left.offsets.extend(right.offsets)
         left.children.extend(right.children)
-
-        # set ancestor node for children of right node to left
-        for child in right.children:
-            child_node = btree.read_node_from_drive(child)
-            child_node.ancestor = left.index
-            btree.write_node_to_drive(child_node)
+        if leaves:
+            left.next = right.next
 
         # delete key and children from ancestor
         ancestor.keys.pop(middle_index)
-        ancestor.offsets.pop(middle_index)
-        ancestor.children.remove(right.index)
+        if not btree.bplus:
+            ancestor.offsets.pop(middle_index)
+        del ancestor.children[middle_index + 1]
 
-        btree.write_node_to_drive(ancestor)
-        btree.write_node_to_drive(left)
         btree.delete_node(right)
 
+        # release emptied root, merged node becomes the new root
         if len(ancestor.keys) == 0 and ancestor.index == btree.root:
             btree.root = left.index
+            btree.write_node_to_drive(left)
+            btree.delete_node(ancestor)
+        else:
+            btree.write_node_to_drive(ancestor)
+            btree.write_node_to_drive(left)
+        if btree.tracer is not None:
+            btree.tracer.record("merge", time.perf_counter() - start)
+
+    @staticmethod
+    def page_size(t, bplus=False):
+        # node may hold t + 1 keys for a moment before it is split,
+        # B+ leaves have no children and internal nodes no offsets
+        if bplus:
+            return NODE_HEADER.size + (2 * (t + 1) + 1) * 8
+        return NODE_HEADER.size + (2 * (t + 1) + (t + 2)) * 8
+
+    @staticmethod
+    def capacity(page_size, bplus=False):
+        # largest t whose nodes fit in the page size
+        if bplus:
+            return (page_size - NODE_HEADER.size - 3 * 8) // (2 * 8)
+        return (page_size - NODE_HEADER.size - 4 * 8) // (3 * 8)
+
+    def to_bytes(self):
+        header = NODE_HEADER.pack(self.t, self.is_leaf, len(self.keys), len(self.offsets), len(self.children),
+                                  self.next)
+        return header + self.keys.tobytes() + self.offsets.tobytes() + self.children.tobytes()
+
+    @staticmethod
+    def from_bytes(index, data):
+        t, is_leaf, keys_count, offsets_count, children_count, next_leaf = NODE_HEADER.unpack_from(data)
+        node = BTreeNode(t, index, is_leaf)
+        node.next = next_leaf
+        values = array('q')
+        start = NODE_HEADER.size
+        values.frombytes(data[start:start + (keys_count + offsets_count + children_count) * 8])
+        node.keys = values[:keys_count]
+        node.offsets = values[keys_count:keys_count + offsets_count]
+        node.children = values[keys_count + offsets_count:]
+        return node
+
+    def copy(self):
+        node = BTreeNode(self.t, self.index, self.is_leaf)
+        node.keys = array('q', self.keys)
+        node.offsets = array('q', self.offsets)
+        node.children = array('q', self.children)
+        node.next = self.next
+        return node
 
     def __repr__(self):
-        return f"Keys: {self.keys}, Values: {self.offsets}, IsLeaf: {self.is_leaf}, Children: {len(self.children)}"
+        return f"Keys: {list(self.keys)}, Values: {list(self.offsets)}, IsLeaf: {self.is_leaf}, Children: {len(self.children)}"
 
 
 class BTree:
-    def __init__(self, file=None, t=4):
+    def __init__(self, file=None, t=None, index_path="tree_structure/index.bin", pool_capacity=128, pool_policy="lru",
+                 group_commit_ops=1, group_commit_ms=None, thread_safe=False, tracer=None, page_size=None,
+                 codec="fixed", bloom=False, bloom_fp_rate=0.01, bloom_bits=None, layout="btree", prefetch=False):
+        # t defaults to 4 keys per node, with a page size it is the number of keys that fit the page
+        if codec not in CODECS:
+            raise ValueError(f"Unknown node codec {codec}")
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown node layout {layout}")
+        bplus = layout == "bplus"
+        if page_size is None and codec != "fixed":
+            page_size = DEFAULT_PAGE_SIZE
+        if page_size is None:
+            t = 4 if t is None else t
+            page_size = BTreeNode.page_size(t, bplus)
+        elif t is None:
+            t = BTreeNode.capacity(page_size, bplus) if codec == "fixed" else capacity(page_size, bplus)
+        elif codec == "fixed" and BTreeNode.page_size(t, bplus) > page_size:
+            raise ValueError(f"Nodes of t={t} do not fit in {page_size} byte pages")
+        if t < 2:
+            raise ValueError(f"Page size {page_size} is too small")
+        pager = Pager(index_path, page_size, codec=CODECS.index(codec), layout=LAYOUTS.index(layout))
+        self._start(pager, t, file, pool_capacity, pool_policy, group_commit_ops, group_commit_ms, thread_safe,
+                    tracer, bloom, bloom_fp_rate, bloom_bits, prefetch)
+        if bloom:
+            self.bloom = self._new_bloom(0)
+        # create root page
+        root_node = BTreeNode(t, self.allocate_node_index(), True)
+        self.write_node_to_drive(root_node)
+        self.flush()
+
+    @classmethod
+    def open(cls, index_path, pool_capacity=128, pool_policy="lru", group_commit_ops=1, group_commit_ms=None,
+             thread_safe=False, tracer=None, bloom=False, bloom_fp_rate=0.01, bloom_bits=None, prefetch=False):
+        # reopens a saved index from its superblock without touching the data file,
+        # operations committed to the log after the last checkpoint are redone first
+        pager, metadata = Pager.open(index_path)
+        recovered = WriteAheadLog.recover(index_path + ".wal", pager)
+        if recovered is not None:
+            metadata.update(recovered)
+            pager.free_head = recovered["free_head"]
+            pager.free_pages = recovered["free_pages"]
+            # compaction committed before its file was swapped in
+            if recovered["replace"] is not None and os.path.exists(recovered["replace"]):
+                os.replace(recovered["replace"], recovered["main_file_path"])
+        if metadata["root"] == -1:
+            pager.close()
+            raise ValueError(f"Building of {index_path} was interrupted")
+
+        tree = cls.__new__(cls)
+        # redone pages are not synced yet, the log keeps them until the checkpoint below
+        tree._start(pager, metadata["t"], metadata["main_file_path"], pool_capacity, pool_policy,
+                    group_commit_ops, group_commit_ms, thread_safe, tracer, bloom, bloom_fp_rate, bloom_bits, prefetch,
+                    keep_log=recovered is not None)
+        tree.root = metadata["root"]
+        tree.index_for_node = metadata["index_for_node"]
+        if recovered is not None and recovered.get("compacting") is not None:
+            tree._point_to_compacted(*recovered["compacting"])
+        if bloom:
+            # a saved filter misses the keys of redone operations
+            tree.bloom = None if recovered is not None else \
+                BloomFilter.load(tree.bloom_path, tree.root, tree.index_for_node)
+            if tree.bloom is None or (bloom_bits is not None and tree.bloom.bits != bloom_bits):
+                tree._rebuild_bloom()
+        tree.flush()
+        return tree
+
+    def _start(self, pager, t, file, pool_capacity, pool_policy, group_commit_ops, group_commit_ms, thread_safe,
+               tracer, bloom, bloom_fp_rate, bloom_bits, prefetch, keep_log=False):
         self.root = 0
         self.t = t
         self.main_file_path = file
+        self.main_file = RecordFile(file) if file is not None else None
+        self.index_path = pager.path
+        self.pager = pager
+        self.codec = CODECS[pager.codec]
+        self.layout = LAYOUTS[pager.layout]
+        self.bplus = self.layout == "bplus"
+        self.buffer_pool = BufferPool(self._load_node, self._store_node, pool_capacity, pool_policy, thread_safe)
+        # shared mode: searches and ranges run in many threads next to one writer
+        self.latches = LatchTable() if thread_safe else None
+        self.writer_lock = self.latches.writer if thread_safe else nullcontext()
+        # pages latched by the running insert or delete
+        self.write_latched = []
+        self.wal = WriteAheadLog(pager.path + ".wal", group_commit_ops, group_commit_ms, self._sync_main_file,
+                                 thread_safe, keep_log)
+        # log size after which pages are checkpointed to the index file
+        self.checkpoint_bytes = 4 * 1024 * 1024
+        # number of pages in the index file
         self.index_for_node = 0
-        # counters
+        # counters, bytes cover index pages and records
         self.write_operations = 0
         self.read_operations = 0
-        # create first file
-        root_node = BTreeNode(t, self.index_for_node, None, True)
-        self.index_for_node += 1
-        self.write_node_to_drive(root_node)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # hooks of tracing.Tracer, every hook is skipped without one
+        self.tracer = tracer
+        # read-ahead of the pages scans and batched lookups visit next, skipped without it
+        self.prefetcher = Prefetcher(pager, self.buffer_pool) if prefetch else None
+        # filter of the keys in the tree, saved to <index>.bloom at every checkpoint
+        self.bloom = None
+        self.bloom_settings = (bloom_fp_rate, bloom_bits) if bloom else None
+        self.bloom_path = pager.path + ".bloom"
+        # lookups answered by the filter without a descent
+        self.bloom_rejections = 0
+        # secondary_index.SecondaryIndex by name, changed with every insert and delete of a record
+        self.secondary_indexes = {}
+        # open snapshot.Snapshot views, replaced instead of changed so the writer can walk it
+        # while a reader releases its snapshot
+        self.snapshots = []
+
+    def bulk_load(self, path, fill_factor=1.0, run_size=1_000_000):
+        with self._writing("bulk_load", exclusive=True):
+            return self._bulk_load(path, fill_factor, run_size)
+
+    def bulk_load_text(self, text_path, record_path, fill_factor=1.0, workers=None):
+        # builds the record file of a text data file and the index with several processes
+        with self._writing("bulk_load", exclusive=True):
+            self._check_bulk_load(fill_factor)
+            # the record file is written anew, the group commit timer must not sync it after it is closed
+            self.wal.sync()
+            if self.main_file is not None:
+                self.main_file.close()
+                self.main_file = None
+            count, records = sort_text_file(text_path, record_path, workers)
+            return self._build(record_path, count, records, fill_factor)
+
+    def _bulk_load(self, path, fill_factor, run_size):
+        self._check_bulk_load(fill_factor)
+        count, records = sort_records(read_records(path), run_size)
+        return self._build(path, count, records, fill_factor)
+
+    def _check_bulk_load(self, fill_factor):
+        self._check_no_snapshots("Bulk load")
+        root = self.read_node_from_drive(self.root)
+        if root.keys or not root.is_leaf:
+            raise ValueError("Bulk load requires an empty tree")
+        if not 0 < fill_factor <= 1:
+            raise ValueError("Fill factor has to be in (0, 1]")
+
+    def _build(self, path, count, records, fill_factor):
+        # writes the tree of count sorted (key, offset) pairs of the data file bottom-up
+        self.wal.sync()
+        if self.main_file is not None:
+            self.main_file.close()
+        self.main_file_path = path
+        self.main_file = RecordFile(path)
+        # nodes are never packed below the underflow threshold used by delete
+        plan = TreePlan(count, max(self.t // 2 + 1, round(self.t * fill_factor)), self.bplus)
+
+        # pages are written once, in post-order, from the start of the index file,
+        # the superblock marks the index as unusable until the build is finished
+        self.buffer_pool.discard(self.root)
+        self.pager.clear_free_pages()
+        self.pager.write_metadata(self.t, -1, 0, path)
+        self.pager.sync()
+        if self.bloom_settings is not None:
+            self.bloom = self._new_bloom(count)
+            records = self._add_to_bloom(records)
+        self.root = plan.nodes - 1
+        # overflow pages of compact nodes follow the planned ones
+        self.index_for_node = plan.nodes
+        # the last leaf of a B+ tree, stored once the next one is known
+        previous_leaf = [None]
+        self._write_subtree(plan, plan.height - 1, 0, 0, records, previous_leaf)
+        if previous_leaf[0] is not None:
+            self._store_node(previous_leaf[0])
+        self.flush()
+        for index in self.secondary_indexes.values():
+            index.rebuild(self._records())
+        return self
+
+    def _write_subtree(self, plan, level, position, first_index, records, previous_leaf):
+        # returns the first key of the subtree, None for an empty tree
+        index = first_index + plan.sizes[level][position] - 1
+        node = BTreeNode(self.t, index, is_leaf=level == 0)
+        if level == 0:
+            for _ in range(plan.leaf_keys[position]):
+                key, offset = next(records)
+                node.keys.append(key)
+                node.offsets.append(offset)
+            first_key = node.keys[0] if node.keys else None
+        else:
+            child_index = first_index
+            first_child = plan.first_child[level]
+            for child in range(first_child[position], first_child[position + 1]):
+                if child != first_child[position] and not self.bplus:
+                    key, offset = next(records)
+                    node.keys.append(key)
+                    node.offsets.append(offset)
+                child_first_key = self._write_subtree(plan, level - 1, child, child_index, records, previous_leaf)
+                if child == first_child[position]:
+                    first_key = child_first_key
+                elif self.bplus:
+                    # B+ separators are copies of the first key of the subtree on their right
+                    node.keys.append(child_first_key)
+                child_index += plan.sizes[level - 1][child]
+                node.children.append(child_index - 1)
+        if level == 0 and self.bplus:
+            if previous_leaf[0] is not None:
+                previous_leaf[0].next = index
+                self._store_node(previous_leaf[0])
+            previous_leaf[0] = node
+        else:
+            self._store_node(node)
+        return first_key
+
+    def _add_to_bloom(self, records):
+        for key, offset in records:
+            self.bloom.add(key)
+            yield key, offset
+
+    def compact(self):
+        with self._writing("compact", exclusive=True):
+            return self._compact()
+
+    def _compact(self):
+        # rewrites live records in key order and points the tree at their new offsets
+        self._check_no_snapshots("Compaction")
+        start = time.perf_counter()
+        old_size = self.main_file.size
+        compacted_path = self.main_file_path + ".compact"
+        if os.path.exists(compacted_path):
+            os.remove(compacted_path)
+        compacted = RecordFile(compacted_path)
+
+        # records are copied before any page changes, so recovery can find their new offsets
+        # in the copy and finish an interrupted compaction
+        records = 0
+        keys = array('q')
+        for node, i in self._iter_positions():
+            compacted.append(node.keys[i], self.main_file.read(node.offsets[i]))
+            records += 1
+            if self.bloom is not None:
+                keys.append(node.keys[i])
+        compacted.sync()
+        compacted.close()
+        # deleted keys are dropped from the filter
+        if self.bloom is not None:
+            self.bloom = self._new_bloom(len(keys))
+            for key in keys:
+                self.bloom.add(key)
+
+        self._point_to_compacted(compacted_path)
+        return {
+            "records": records,
+            "reclaimed_bytes": old_size - self.main_file.size,
+            "seconds": time.perf_counter() - start,
+        }
+
+    def _point_to_compacted(self, compacted_path, done=None):
+        # sets the offsets of the keys after done to the records of the compacted copy, which
+        # holds them in the same order; pages are logged in chunks of the buffer pool capacity,
+        # each chunk with the last key it covers, the last one with the pending swap of the files
+        compacted = RecordFile(compacted_path)
+        records = ((offset, key) for offset, _, key, _ in compacted.scan() if done is None or key > done)
+        for node, i in self._iter_positions(None if done is None else done + 1):
+            offset, key = next(records, (None, None))
+            if key != node.keys[i]:
+                raise ValueError(f"{compacted_path} does not match the index at key {node.keys[i]}")
+            node.offsets[i] = offset
+            self.write_node_to_drive(node)
+            if len(self.buffer_pool.uncommitted) >= self.buffer_pool.capacity:
+                self._log_commit(compacting=(compacted_path, key))
+        records.close()
+        compacted.close()
+
+        # new offsets are durable together with the pending swap, recovery finishes it
+        self._log_commit(replace=compacted_path)
+        self.wal.sync()
+        self.main_file.close()
+        os.replace(compacted_path, self.main_file_path)
+        self.main_file = RecordFile(self.main_file_path)
+        self.flush()
 
     def traverse(self):
+        if self.latches is not None:
+            # the writer keeps running, the snapshot keeps the scan consistent
+            with self.snapshot() as snapshot:
+                return snapshot.traverse()
+        if self.bplus:
+            return [node.keys[i] for node, i in self._iter_positions()]
         result = []
         self._traverse_helper(self.root, result)
         return result
 
     def _traverse_helper(self, node_index, result):
         node = self.read_node_from_drive(node_index)
+        if self.prefetcher is not None and not node.is_leaf:
+            self.prefetcher.prefetch(node.children)
         i = 0
         while i < len(node.keys):
             if not node.is_leaf:
@@ -220,240 +579,962 @@ class BTree:
         if not node.is_leaf:
             self._traverse_helper(node.children[i], result)
 
-    def search(self, k, node_index=None):
-        if node_index is None:
-            node_index = self.root
-        node = self.read_node_from_drive(node_index)
-        i = 0
-        while i < len(node.keys) and k > node.keys[i]:
-            i += 1
+    def iter_from(self, key):
+        # (key, offset) pairs in key order starting at the first key >= key
+        pairs = self._iter_pairs(key)
+        if self.tracer is not None:
+            return self.tracer.wrap("range", pairs)
+        return pairs
+
+    def _iter_pairs(self, key):
+        if self.latches is None:
+            for node, i in self._iter_positions(key):
+                yield node.keys[i], node.offsets[i]
+            return
+        # in shared mode pairs are copied in batches, every batch starts with a new descent
+        # so the writer is not held back while the caller consumes them
+        while key is not None:
+            batch, key = self._read_batch(key)
+            yield from batch
 
-        if i < len(node.keys) and node.keys[i] == k:
-            return node, "found"
+    def _read_batch(self, key):
+        # pairs of the leaf for the key up to the separator that follows it,
+        # returns them and the key the next batch starts at, None after the last key
+        latched = []
+        with self._reading():
+            path = []
+            node = self._read_root(latched)
+            while True:
+                i = self._position(node, key)
+                path.append((node, i))
+                if node.is_leaf:
+                    break
+                node = self._read_shared(node.children[i], latched)
 
-        if node.is_leaf:
-            return node, "not found"
+            # nodes right of the path, the following batches descend into them
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch([child for ancestor, position in path[:-1]
+                                          for child in ancestor.children[position + 1:]])
+            batch = list(zip(node.keys[i:], node.offsets[i:]))
+            next_key = None
+            for ancestor, position in reversed(path[:-1]):
+                if position < len(ancestor.keys):
+                    if self.bplus:
+                        # the separator is the first key of the next leaf
+                        next_key = ancestor.keys[position]
+                    else:
+                        batch.append((ancestor.keys[position], ancestor.offsets[position]))
+                        next_key = ancestor.keys[position] + 1
+                    break
+            self._release_shared(latched)
+        return batch, next_key
+
+    def _iter_positions(self, key=None, root=None, read=None):
+        # (node, position) of every key in key order starting at the first key >= key, the stack
+        # holds [node, position] of every level of the current path; a snapshot passes its root
+        # and node reader
+        read = read or self.read_node_from_drive
+        stack = []
+        node = read(self.root if root is None else root)
+        while True:
+            i = 0 if key is None else self._position(node, key)
+            stack.append([node, i])
+            if node.is_leaf:
+                break
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch(node.children[i:])
+            node = read(node.children[i])
+
+        if self.bplus:
+            # B+ leaves are walked along their chain, the levels above are only followed for prefetching
+            parents = stack[:-1]
+            ahead = parents[-1][0].children[parents[-1][1]:] if parents else ()
+            while True:
+                for i in range(i, len(node.keys)):
+                    yield node, i
+                if node.next == -1:
+                    return
+                if self.prefetcher is not None and node.next not in ahead:
+                    ahead = self._prefetch_leaves(parents, len(stack) - 1, read)
+                node = read(node.next)
+                i = 0
+
+        while stack:
+            node, i = stack[-1]
+            if i >= len(node.keys):
+                stack.pop()
+                continue
+            yield node, i
+            stack[-1][1] = i + 1
+            if not node.is_leaf:
+                # continue with the leftmost path of the next subtree
+                child = read(node.children[i + 1])
+                stack.append([child, 0])
+                while not child.is_leaf:
+                    if self.prefetcher is not None:
+                        self.prefetcher.prefetch(child.children)
+                    child = read(child.children[0])
+                    stack.append([child, 0])
+
+    def _prefetch_leaves(self, parents, levels, read):
+        # read-ahead of the B+ leaves under the parent following the last one in parents,
+        # which holds [node, position] of every level above the leaves and is moved on to it;
+        # the nodes on the way are read ahead like in a descent, returns the leaves
+        parents.pop()
+        while parents and parents[-1][1] + 1 >= len(parents[-1][0].children):
+            parents.pop()
+        if not parents:
+            return ()
+        parents[-1][1] += 1
+        while True:
+            node, position = parents[-1]
+            ahead = node.children[position:]
+            self.prefetcher.prefetch(ahead)
+            if len(parents) == levels:
+                return ahead
+            parents.append([read(node.children[position]), 0])
+
+    def range(self, lo, hi, include_values=False):
+        pairs = self._range(lo, hi, include_values)
+        if self.tracer is not None:
+            return self.tracer.wrap("range", pairs)
+        return pairs
+
+    def _range(self, lo, hi, include_values):
+        for key, offset in self.iter_from(lo):
+            if key > hi:
+                return
+            if include_values:
+                yield key, self.read_from_main_file(offset)
+            else:
+                yield key, offset
 
-        return self.search(k, node.children[i])
+    def search(self, k):
+        if self.bloom is not None and k not in self.bloom:
+            self.bloom_rejections += 1
+            return None, "not found"
+        latched = []
+
+        def read(node_index):
+            node = self._read_shared(node_index, latched)
+            # latch coupling, the ancestor is released once its child is latched
+            self._release_shared(latched, keep=1)
+            return node
+
+        with self._reading("search"):
+            result = self._search_from(self._read_root(latched), k, read)
+            self._release_shared(latched)
+        return result
+
+    def _search_from(self, node, key, read):
+        # node holding the key and "found", or the leaf it belongs to and "not found",
+        # read gives the child of a node
+        while True:
+            i = self._position(node, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                return node, "found"
+            if node.is_leaf:
+                return node, "not found"
+            node = read(node.children[i])
+
+    def search_many(self, keys):
+        # one descent for the whole sorted batch, keys sharing a path are routed together,
+        # in shared mode the visited pages stay latched until the batch is resolved
+        result = {}
+        keys = sorted(set(keys))
+        if self.bloom is not None:
+            # keys missing from the filter are certainly not in the tree
+            bloom = self.bloom
+            for k in keys:
+                if k not in bloom:
+                    result[k] = None, "not found"
+            if result:
+                self.bloom_rejections += len(result)
+                keys = [k for k in keys if k not in result]
+        if keys:
+            result.update(self._search_batch(keys))
+        return result
+
+    def _search_batch(self, keys, visited=None):
+        # node of every sorted key and its status, found or the leaf it would be inserted into,
+        # visited gets the internal nodes of the descent by their page index
+        result = {}
+        latched = []
+        with self._reading("search_many"):
+            pending = [(self._read_root(latched), keys)]
+            while pending:
+                node, group = pending.pop()
+                i = 0
+                child_group = []
+                # (child, keys routed to it), every child of the node the batch visits is known
+                # before the first one is read
+                children = []
+                for k in group:
+                    position = self._position(node, k, i)
+                    if position != i:
+                        if child_group:
+                            children.append((node.children[i], child_group))
+                            child_group = []
+                        i = position
+                    if i < len(node.keys) and node.keys[i] == k:
+                        result[k] = node, "found"
+                    elif node.is_leaf:
+                        result[k] = node, "not found"
+                    else:
+                        child_group.append(k)
+                if child_group:
+                    children.append((node.children[i], child_group))
+                if visited is not None and not node.is_leaf:
+                    visited[node.index] = node
+                if self.prefetcher is not None and children:
+                    self.prefetcher.prefetch([child for child, _ in children])
+                for child, child_group in children:
+                    pending.append((self._read_shared(child, latched), child_group))
+            self._release_shared(latched)
+        return result
 
     def insert(self, key, value, loading_file=False):
-        node, status = self.search(key)
-        if status == "found":
+        with self._writing("insert"):
+            self._insert(key, value, loading_file)
+            self.commit()
+            self._grow_bloom()
+
+    def _insert(self, key, value, loading_file):
+        path = self._descend(key, self._insert_safe)
+        node, i = path[-1]
+        if i < len(node.keys) and node.keys[i] == key:
             return
 
-        if node is None:
-            node = self.read_node_from_drive(self.root)
+        offset = value if loading_file else self.insert_to_main_file(key, value)
+        # readers may skip the key as soon as the filter misses it, so it is added first
+        if self.bloom is not None:
+            self.bloom.add(key)
+        self._insert_into_leaf(key, offset, path)
+        if self.secondary_indexes:
+            record = self.read_from_main_file(offset) if loading_file else str(value)
+            for index in self.secondary_indexes.values():
+                index.add(key, record)
+
+    def insert_many(self, pairs, loading_file=False):
+        with self._writing("insert_many"):
+            inserted = self._insert_many(pairs, loading_file)
+            self._grow_bloom()
+        return inserted
+
+    def _insert_many(self, pairs, loading_file):
+        # first value of a repeated key wins, as with consecutive insert calls
+        batch = {}
+        for key, value in pairs:
+            batch.setdefault(key, value)
+        # the leaves the batch ends in are known before the first insert, the filter is skipped
+        held = {}
+        found = self._search_batch(sorted(batch), held)
+        keys = [key for key in sorted(batch) if found[key][1] == "not found"]
+        if loading_file:
+            offsets = [batch[key] for key in keys]
+        else:
+            offsets = self.insert_many_to_main_file((key, batch[key]) for key in keys)
+        if self.bloom is not None:
+            for key in keys:
+                self.bloom.add(key)
+
+        leaf, bounds = None, None
+        # leaves that were split or evened out with a sibling, their keys may have moved
+        overflowed = set()
+        for key, offset in zip(keys, offsets):
+            # the leaf the batch descent ended in, it is the page in the buffer pool while the
+            # batch holds it, only a full one needs the path from the root
+            target = found[key][0]
+            if target.index in overflowed or len(target.keys) >= self.t:
+                target = None
+            # keys of one leaf are added together while it has room, the page is saved once
+            if leaf is not None and len(leaf.keys) < self.t and (leaf is target or (
+                    bounds is not None and (bounds[0] is None or bounds[0] <= key)
+                    and (bounds[1] is None or key < bounds[1]))):
+                self.insert_into_node(key, offset, leaf)
+                continue
+            if leaf is not None:
+                self.write_node_to_drive(leaf)
+                self._release_write_latches()
+                self._commit_part()
+                leaf = None
+            if target is not None:
+                leaf, bounds = self.read_node_for_write(target.index, target), None
+                self.insert_into_node(key, offset, leaf)
+                continue
+            path, lo, hi = self._find_leaf(key, held)
+            leaf = path[-1][0]
+            if len(leaf.keys) < self.t:
+                self.insert_into_node(key, offset, leaf)
+                bounds = lo, hi
+            else:
+                overflowed.add(leaf.index)
+                self._insert_into_leaf(key, offset, path)
+                self._release_write_latches()
+                self._commit_part()
+                leaf = None
+            for node, _ in path:
+                held[node.index] = node
+        if leaf is not None:
+            self.write_node_to_drive(leaf)
+        if self.secondary_indexes:
+            records = [(key, self.read_from_main_file(offset) if loading_file else str(batch[key]))
+                       for key, offset in zip(keys, offsets)]
+            for index in self.secondary_indexes.values():
+                index.add_many(records)
+        self.commit()
+        return len(keys)
+
+    def _position(self, node, key, lo=0):
+        # B+ separators are the first keys of the subtrees on their right, so an equal key goes right
+        if self.bplus and not node.is_leaf:
+            return bisect_right(node.keys, key, lo)
+        return bisect_left(node.keys, key, lo)
+
+    def _descend(self, key, safe=None):
+        # [node, position of the key] of every level, from the root down to the node
+        # holding the key or the leaf it belongs to, nodes do not know their ancestors;
+        # the writer passes safe and latches the path, see _crab
+        path = []
+        node = self.read_root_for_write() if safe is not None else self.read_node_from_drive(self.root)
+        while True:
+            if safe is not None:
+                self._crab(node, safe)
+            i = self._position(node, key)
+            path.append([node, i])
+            if node.is_leaf or (i < len(node.keys) and node.keys[i] == key):
+                return path
+            if safe is not None:
+                node = self.read_node_for_write(node.children[i])
+            else:
+                node = self.read_node_from_drive(node.children[i])
 
-        # insert new key if node is not full
-        if len(node.keys) <= self.t:
-            if not loading_file:
-                value = self.insert_to_main_file(key, value)
-            self.insert_into_node(key, value, node)
+    def _find_leaf(self, key, held=None):
+        # latched descent path to the leaf for the key and the separators bounding it,
+        # None stands for no bound; held maps page indexes to nodes of an insert-only batch
+        # the descent takes instead of the buffer pool
+        held = held or {}
+        lo, hi = None, None
+        path = []
+        node = self.read_root_for_write(held.get(self.root))
+        while True:
+            self._crab(node, self._insert_safe)
+            i = self._position(node, key)
+            path.append([node, i])
+            if i > 0:
+                lo = node.keys[i - 1]
+            if i < len(node.keys):
+                hi = node.keys[i]
+            if node.is_leaf:
+                return path, lo, hi
+            node = self.read_node_for_write(node.children[i], held.get(node.children[i]))
+
+    def _insert_into_leaf(self, key, offset, path):
+        node = path[-1][0]
+        self.insert_into_node(key, offset, node)
 
         if len(node.keys) > self.t:
             # overflow
             # try compensation
-            ancestor_node = self.read_node_from_drive(node.ancestor)
-            left, right = BTreeNode.get_node_sibling(node, ancestor_node, self)
-            if ancestor_node is not None:
-                if BTreeNode.compensation_insert(left, right, node, ancestor_node, ancestor_node.children.index(node.index) - 1, self):
+            if len(path) > 1:
+                ancestor_node, position = path[-2]
+                left, right = BTreeNode.get_node_sibling(ancestor_node, position, self)
+                if BTreeNode.compensation_insert(left, right, node, ancestor_node, position - 1, self):
                     return
             # compensation impossible
             # make a split
-            BTreeNode.split(node, self)
+            BTreeNode.split(path, self)
         else:
             self.write_node_to_drive(node)
 
     def delete(self, key):
-        node, status = self.search(key)
-        if status == "not found":
-            print("Not found")
-            return
-        key_index = node.keys.index(key)
+        # True if the key was in the tree
+        with self._writing("delete"):
+            deleted = self._delete(key)
+            self.commit()
+        return deleted
+
+    def delete_many(self, keys):
+        # deletes in key order, returns the deleted keys in key order
+        with self._writing("delete_many"):
+            deleted = self._delete_many(keys)
+            self.commit()
+        return deleted
+
+    def _delete_many(self, keys):
+        # one descent for the whole batch finds the keys, missing ones are skipped and a key in
+        # a leaf that stays above the underflow threshold is removed without another descent;
+        # a leaf merged away or changed by the rebalancing of an earlier key is descended to again
+        keys = sorted(set(keys))
+        found = self.search_many(keys)
+        deleted = []
+        for key in keys:
+            node, status = found[key]
+            if status != "found":
+                continue
+            i = self._position(node, key)
+            if node.is_leaf and self.buffer_pool.holds(node) and self._delete_safe(node) \
+                    and i < len(node.keys) and node.keys[i] == key:
+                node = self.read_node_for_write(node.index, node)
+                self._drop_record(key, node.offsets[i])
+                del node.keys[i]
+                del node.offsets[i]
+                self.write_node_to_drive(node)
+                deleted.append(key)
+            elif self._delete(key):
+                deleted.append(key)
+            self._release_write_latches()
+            self._commit_part()
+        return deleted
+
+    def _delete(self, key):
+        if self.bloom is not None and key not in self.bloom:
+            self.bloom_rejections += 1
+            return False
+        path = self._descend(key, self._delete_safe)
+        node, key_index = path[-1]
+        if key_index == len(node.keys) or node.keys[key_index] != key:
+            return False
+        self._drop_record(key, node.offsets[key_index])
         if not node.is_leaf:
-            neighbour_key, neighbour_node, type = self.find_predecessor(key)
-            if neighbour_key is None:
-                neighbour_key, neighbour_node, type = self.find_successor(key)
-            if neighbour_key is None:
-                return
-            # remove from main file
-            self.delete_from_main_file(node.offsets[key_index])
-            # replace deleting value with neighbor
-            neighbour_index = len(neighbour_node.keys) - 1 if type == "predecessor" else 0
-            neighbour_offset = neighbour_node.offsets[neighbour_index]
-            node.keys[key_index] = neighbour_key
-            node.offsets[key_index] = neighbour_offset
+            # replace deleting value with its predecessor, the path goes on to its leaf
+            neighbour_node = self.read_node_for_write(node.children[key_index])
+            self._crab(neighbour_node, self._delete_safe, keep=(node.index,))
+            path.append([neighbour_node, len(neighbour_node.children) - 1])
+            while not neighbour_node.is_leaf:
+                neighbour_node = self.read_node_for_write(neighbour_node.children[-1])
+                self._crab(neighbour_node, self._delete_safe, keep=(node.index,))
+                path.append([neighbour_node, len(neighbour_node.children) - 1])
+            node.keys[key_index] = neighbour_node.keys[-1]
+            node.offsets[key_index] = neighbour_node.offsets[-1]
             # remove predecessor from its old node
-            neighbour_node.keys.remove(neighbour_key)
-            neighbour_node.offsets.remove(neighbour_offset)
-            self.compensate_and_merge(neighbour_node)
+            del neighbour_node.keys[-1]
+            del neighbour_node.offsets[-1]
+            # save before rebalancing, merged pages are released for reuse
             self.write_node_to_drive(node)
             self.write_node_to_drive(neighbour_node)
         else:
-            offset = int(node.offsets[key_index])
-            node.keys.remove(key)
-            node.offsets.remove(offset)
-            # remove from main file
-            self.delete_from_main_file(offset)
-            self.compensate_and_merge(node)
+            del node.keys[key_index]
+            del node.offsets[key_index]
             self.write_node_to_drive(node)
+        self.compensate_and_merge(path)
+        return True
 
-    def compensate_and_merge(self, node):
-        if node == self.root:
-            return
-        if node.ancestor is None:
+    def _drop_record(self, key, offset):
+        # the old value is read first to find its entries in the secondary indexes
+        if self.secondary_indexes:
+            record = self.read_from_main_file(offset)
+            for index in self.secondary_indexes.values():
+                index.remove(key, record)
+        # remove from main file, trees of secondary indexes have none
+        if self.main_file is not None:
+            self.delete_from_main_file(offset)
+
+    def add_secondary_index(self, index, build=True):
+        # the index is filled with the records of the tree, unless it was reopened
+        # and already holds them
+        if index.name in self.secondary_indexes:
+            raise ValueError(f"Secondary index {index.name} already exists")
+        if build:
+            with self._reading("build_index"):
+                index.rebuild(self._records())
+        self.secondary_indexes[index.name] = index
+        return index
+
+    def search_by(self, name, value_key):
+        # (key, value) of every record whose value maps to the value key in the secondary index
+        result = []
+        for key, (node, status) in sorted(self.search_many(self.secondary_indexes[name].lookup(value_key)).items()):
+            if status == "found":
+                result.append((key, self.read_from_main_file(node.offsets[bisect_left(node.keys, key)])))
+        return result
+
+    def _records(self):
+        # (key, value) of every record in key order
+        for node, i in self._iter_positions():
+            yield node.keys[i], self.read_from_main_file(node.offsets[i])
+
+    def compensate_and_merge(self, path):
+        # path holds [node, position of the next node] from the root down to the node
+        if len(path) < 2:
             return
+        node = path[-1][0]
         if len(node.keys) <= self.t // 2:
-            # print("Compensating/merging...")
-            ancestor_node = self.read_node_from_drive(node.ancestor)
-            left, right = BTreeNode.get_node_sibling(node, ancestor_node, self)
-            middle_index = ancestor_node.children.index(node.index) - 1
-            if BTreeNode.compensation_delete(left, right, node, ancestor_node, middle_index, self):
+            ancestor_node, position = path[-2]
+            left, right = BTreeNode.get_node_sibling(ancestor_node, position, self)
+            if BTreeNode.compensation_delete(left, right, node, ancestor_node, position - 1, self):
                 return
             if left is not None and len(left.keys) + len(node.keys) < self.t:
-                middle_index = ancestor_node.children.index(left.index) - 1
-                BTreeNode.merge(left, node, ancestor_node, middle_index + 1, self)
+                BTreeNode.merge(left, node, ancestor_node, position - 1, self)
             elif right is not None and len(right.keys) + len(node.keys) < self.t:
-                middle_index = ancestor_node.children.index(right.index) - 1
-                BTreeNode.merge(node, right, ancestor_node, middle_index, self)
-            # print("After compensation/merge...")
-            # self.display()
-            self.compensate_and_merge(ancestor_node)
+                BTreeNode.merge(node, right, ancestor_node, position, self)
+            self.compensate_and_merge(path[:-1])
+
+    def _new_bloom(self, keys):
+        # a filter of fixed size is never regrown, others are sized for twice the keys
+        fp_rate, bits = self.bloom_settings
+        return BloomFilter.for_keys(max(MIN_CAPACITY, 2 * keys), fp_rate, bits)
+
+    def _rebuild_bloom(self):
+        keys = array('q')
+        for node, i in self._iter_positions():
+            keys.append(node.keys[i])
+        bloom = self._new_bloom(len(keys))
+        for key in keys:
+            bloom.add(key)
+        self.bloom = bloom
+
+    def _grow_bloom(self):
+        # the false positive rate rises past the capacity of the filter
+        if self.bloom is not None and self.bloom_settings[1] is None and self.bloom.count > self.bloom.capacity:
+            self._rebuild_bloom()
 
     def find_predecessor(self, key):
-        node, status = self.search(key)
-        if status == "not found":
-            return None, None, None
+        with self.writer_lock:
+            path = self._descend(key)
+            node, i = path[-1]
+            if i == len(node.keys) or node.keys[i] != key:
+                return None, None, None
 
-        # Find the index of the key in the node
-        i = node.keys.index(key)
-        if not node.is_leaf:
-            # Move to the right subtree of the key (left side of the node)
-            predecessor_node = self.read_node_from_drive(node.children[i])
-            while not predecessor_node.is_leaf:
-                predecessor_node = self.read_node_from_drive(predecessor_node.children[-1])
-            if len(predecessor_node.keys) == 0:
+            if self.bplus and i == 0:
+                # last key of the leaf left of the first subtree entered right of a separator
+                for ancestor, index_in_parent in reversed(path[:-1]):
+                    if index_in_parent > 0:
+                        predecessor_node = self.read_node_from_drive(ancestor.children[index_in_parent - 1])
+                        while not predecessor_node.is_leaf:
+                            predecessor_node = self.read_node_from_drive(predecessor_node.children[-1])
+                        return predecessor_node.keys[-1], predecessor_node, "predecessor"
                 return None, None, None
-            return predecessor_node.keys[-1], predecessor_node, "predecessor"
-        else:
-            # Search in the parent node if there are no children
-            while node.ancestor is not None:
-                ancestor = self.read_node_from_drive(node.ancestor)
-                index_in_parent = ancestor.children.index(node)
+            if not node.is_leaf:
+                # Move to the right subtree of the key (left side of the node)
+                predecessor_node = self.read_node_from_drive(node.children[i])
+                while not predecessor_node.is_leaf:
+                    predecessor_node = self.read_node_from_drive(predecessor_node.children[-1])
+                return predecessor_node.keys[-1], predecessor_node, "predecessor"
+            if i > 0:
+                return node.keys[i - 1], node, "predecessor"
+            # Walk up the descent path to the first ancestor entered right of a key
+            for ancestor, index_in_parent in reversed(path[:-1]):
                 if index_in_parent > 0:
                     return ancestor.keys[index_in_parent - 1], ancestor, "predecessor"
-                node = ancestor
 
             # No predecessor found (key is the smallest in the tree)
             return None, None, None
 
     def find_successor(self, key):
-        node, status = self.search(key)
-        if status == "not found":
-            return None, None, None  # Key does not exist
+        with self.writer_lock:
+            path = self._descend(key)
+            node, i = path[-1]
+            if i == len(node.keys) or node.keys[i] != key:
+                return None, None, None  # Key does not exist
 
-        # Find the index of the key in the node
-        i = node.keys.index(key)
-        if not node.is_leaf:
-            # Move to the left subtree of the key (right side of the node)
-            successor_node = self.read_node_from_drive(node.children[i + 1])
-            while not successor_node.is_leaf:
-                successor_node = self.read_node_from_drive(successor_node.children[0])
-            if len(successor_node.keys) == 0:
-                return None, None, None
-            return successor_node.keys[0], successor_node, "successor"
-        else:
-            # Search in the parent node if there are no children
-            while node.ancestor is not None:
-                ancestor = self.read_node_from_drive(node.ancestor)
-                index_in_parent = ancestor.children.index(node.index)
+            if self.bplus and i == len(node.keys) - 1:
+                # first key of the next leaf in the chain
+                if node.next == -1:
+                    return None, None, None
+                successor_node = self.read_node_from_drive(node.next)
+                return successor_node.keys[0], successor_node, "successor"
+            if not node.is_leaf:
+                # Move to the left subtree of the key (right side of the node)
+                successor_node = self.read_node_from_drive(node.children[i + 1])
+                while not successor_node.is_leaf:
+                    successor_node = self.read_node_from_drive(successor_node.children[0])
+                return successor_node.keys[0], successor_node, "successor"
+            if i < len(node.keys) - 1:
+                return node.keys[i + 1], node, "successor"
+            # Walk up the descent path to the first ancestor entered left of a key
+            for ancestor, index_in_parent in reversed(path[:-1]):
                 if index_in_parent < len(ancestor.keys):
                     return ancestor.keys[index_in_parent], ancestor, "successor"
-                node = ancestor
             # No successor found (key is the largest in the tree)
             return None, None, None
 
     @staticmethod
     def insert_into_node(key, offset, node):
-        i = 0
-        while i < len(node.keys):
-            if key <= node.keys[i]:
-                node.keys.insert(i, key)
-                node.offsets.insert(i, offset)
-                return
-            i += 1
-
+        i = bisect_left(node.keys, key)
         node.keys.insert(i, key)
         node.offsets.insert(i, offset)
 
-    def display(self, node=None, level=0, offsets=True):
+    def display(self, node=None, level=0, offsets=True, file=None):
         if node is None:
-            node = self.read_node_from_drive(self.root)
+            # printed from a snapshot, so it is consistent without holding back the writer
+            with self.snapshot() as snapshot:
+                snapshot.display(offsets, file, level)
+            return
+        self._display(node, level, offsets, file, self.read_node_from_drive)
 
-        print("-" * level + str(node.keys) + (str(node.offsets) if offsets else "") + " Children: " + str(len(node.children)))
+    def _display(self, node, level, offsets, file, read):
+        print("-" * level + str(list(node.keys)) + (str(list(node.offsets)) if offsets else "") + " Children: " + str(len(node.children)), file=file)
+        if self.prefetcher is not None and node.children:
+            self.prefetcher.prefetch(node.children)
         for child in node.children:
-            child_node = self.read_node_from_drive(child)
-            self.display(child_node, level + 1, offsets)
+            self._display(read(child), level + 1, offsets, file, read)
+
+    def stats(self):
+        # shape of the tree level by level and the share of deleted records in the data file
+        with self.writer_lock:
+            height = 0
+            nodes = 0
+            overflow_pages = 0
+            keys = 0
+            entries = 0
+            # nodes by fill factor in steps of 10%, full nodes are counted in the last step
+            fill = [0] * 10
+            level = [self.root]
+            while level:
+                height += 1
+                next_level = []
+                for node_index in level:
+                    node = self.read_node_from_drive(node_index)
+                    nodes += 1
+                    overflow_pages += len(node.overflow)
+                    entries += len(node.keys)
+                    # separators of a B+ tree repeat keys of its leaves
+                    if node.is_leaf or not self.bplus:
+                        keys += len(node.keys)
+                    fill[min(9, len(node.keys) * 10 // self.t)] += 1
+                    next_level.extend(node.children)
+                level = next_level
+
+            records = dead_records = dead_bytes = 0
+            if self.main_file is not None:
+                for _, flag, _, value in self.main_file.scan():
+                    records += 1
+                    if not flag:
+                        dead_records += 1
+                        dead_bytes += RECORD_HEADER.size + len(value)
+            return {
+                "height": height,
+                "nodes": nodes,
+                "keys": keys,
+                "index_pages": self.index_for_node,
+                "overflow_pages": overflow_pages,
+                "free_pages": self.index_for_node - nodes - overflow_pages,
+                "average_fill": entries / (nodes * self.t),
+                "fill_distribution": {f"{10 * i}-{10 * (i + 1)}%": count for i, count in enumerate(fill)},
+                "records": records,
+                "dead_records": dead_records,
+                "dead_record_ratio": dead_records / records if records else 0.0,
+                "dead_bytes": dead_bytes,
+            }
 
     def read_from_main_file(self, offset):
-        with open(self.main_file_path, 'r') as f:
-            f.seek(offset)
-            _, _, value = f.readline().strip().split(':')
-            return value
+        if self.tracer is not None:
+            start = time.perf_counter()
+        value = self.main_file.read(offset)
+        self.bytes_read += RECORD_HEADER.size + len(value)
+        value = bytes(value).decode()
+        if self.tracer is not None:
+            self.tracer.record("record_read", time.perf_counter() - start)
+        return value
 
     def insert_to_main_file(self, key, value):
-        with open(self.main_file_path, 'a') as f:
-            offset = f.tell()
-            f.write("1: " + str(key) + ": " + str(value) + "\n")
+        if self.tracer is not None:
+            start = time.perf_counter()
+        value = str(value).encode()
+        self.bytes_written += RECORD_HEADER.size + len(value)
+        offset = self.main_file.append(key, value)
+        if self.tracer is not None:
+            self.tracer.record("record_write", time.perf_counter() - start)
         return offset
 
-    def delete_from_main_file(self, value):
-        with open(self.main_file_path, 'r+') as f:
-            f.seek(value)
-            line = f.readline()
-            print(f"Original line: {line}")
-
-            new_line = line.replace('1', '0', 1)
-            print(f"Modified line: {new_line}")
+    def insert_many_to_main_file(self, pairs):
+        return [self.insert_to_main_file(key, value) for key, value in pairs]
 
-            f.seek(value)
-            f.write(new_line)
+    def delete_from_main_file(self, value):
+        # only the live flag of the record is overwritten
+        if self.tracer is not None:
+            start = time.perf_counter()
+        self.bytes_written += 1
+        self.main_file.delete(value)
+        if self.tracer is not None:
+            self.tracer.record("record_delete", time.perf_counter() - start)
 
     def write_node_to_drive(self, node):
-        with open(f"tree_structure/{node.index}.txt", "w") as f:
-            f.write(str(node.t) + '\n')
-            f.write(str(node.ancestor)+ '\n')
-            f.write(str(node.is_leaf)+ '\n')
-            f.write(str(node.keys)+ '\n')
-            f.write(str(node.offsets)+ '\n')
-            f.write(str(node.children)+ '\n')
-        self.write_operations += 1
-
+        self.buffer_pool.put(node)
 
     def read_node_from_drive(self, node_index):
         if node_index is None:
             return None
+        return self.buffer_pool.get(node_index)
 
-        self.read_operations += 1
-        with open(f"tree_structure/{node_index}.txt", "r") as f:
-            t = int(f.readline().strip())
-            node = BTreeNode(t, node_index)
-            anc = f.readline().strip()
-            if anc == "None":
-                node.ancestor = None
-            else:
-                node.ancestor = int(anc)
-            node.is_leaf = True if f.readline().strip() == "True" else False
-            line = f.readline().strip()
-            node.keys = [] if line == "[]" else list(map(int, line.strip()[1:-1].split(',')))
-            line = f.readline().strip()
-            node.offsets = [] if line == "[]" else list(map(int, line.strip()[1:-1].split(',')))
-            line = f.readline().strip()
-            node.children = [] if line == "[]" else list(map(int, line.strip()[1:-1].split(',')))
+    def read_node_for_write(self, node_index, node=None):
+        # a node the caller still holds is the page of the buffer pool and is not looked up again
+        if self.latches is not None:
+            self._latch_write(node_index)
+        if node is None:
+            node = self.read_node_from_drive(node_index)
+        if self.snapshots:
+            self._preserve(node)
+        return node
+
+    def snapshot(self):
+        # consistent read view of the tree, also a context manager releasing it,
+        # taken between two write operations
+        with self.writer_lock:
+            snapshot = Snapshot(self)
+            self.snapshots = self.snapshots + [snapshot]
+        return snapshot
+
+    def release_snapshot(self, snapshot):
+        self.snapshots = [s for s in self.snapshots if s is not snapshot]
+
+    def _preserve(self, node):
+        # copy on write: every node is changed or freed only after the writer read it with
+        # read_node_for_write, so snapshots get the version they see before it changes;
+        # pages allocated later were free when the snapshots were taken or are copied already
+        copy = None
+        for snapshot in self.snapshots:
+            if node.index not in snapshot.pages:
+                if copy is None:
+                    copy = node.copy()
+                snapshot.pages[node.index] = copy
+
+    def _check_no_snapshots(self, operation):
+        # both rewrite pages or records in place
+        if self.snapshots:
+            raise ValueError(f"{operation} is not possible while snapshots are open")
+
+    def read_root_for_write(self, node=None):
+        # the root latch keeps the root pointer while the root page may still split or collapse
+        if self.latches is not None:
+            self._latch_write(ROOT)
+        return self.read_node_for_write(self.root, node)
+
+    def _read_root(self, latched):
+        if self.latches is None:
+            return self.read_node_from_drive(self.root)
+        self.latches.acquire(ROOT)
+        node_index = self.root
+        self.latches.acquire(node_index)
+        self.latches.release(ROOT)
+        latched.append(node_index)
+        return self.read_node_from_drive(node_index)
+
+    def _read_shared(self, node_index, latched):
+        # the latch is kept until the caller releases the latched pages
+        if self.latches is not None:
+            self.latches.acquire(node_index)
+            latched.append(node_index)
+        return self.read_node_from_drive(node_index)
+
+    def _release_shared(self, latched, keep=0):
+        # releases all but the last keep latches
+        if self.latches is not None:
+            while len(latched) > keep:
+                self.latches.release(latched.pop(0))
+
+    def _latch_write(self, index):
+        self.latches.acquire(index, exclusive=True)
+        self.write_latched.append(index)
+        if index != ROOT:
+            # a half modified page must not be written out by eviction
+            self.buffer_pool.pin(index)
+
+    def _release_write_latches(self, keep=()):
+        if self.latches is None:
+            return
+        held = []
+        for index in self.write_latched:
+            if index in keep:
+                held.append(index)
+                continue
+            if index != ROOT:
+                self.buffer_pool.unpin(index)
+            self.latches.release(index, exclusive=True)
+        self.write_latched = held
+
+    def _crab(self, node, safe, keep=()):
+        # latch crabbing: a node that absorbs the change of the operation without
+        # splitting or underflowing frees every latch above it
+        if self.latches is not None and safe(node):
+            self._release_write_latches((node.index,) + keep)
+
+    def _insert_safe(self, node):
+        return len(node.keys) < self.t
+
+    def _delete_safe(self, node):
+        return len(node.keys) > self.t // 2 + 1
+
+    @contextmanager
+    def _writing(self, operation, exclusive=False):
+        # one insert or delete at a time, exclusive operations also wait for every reader
+        if self.tracer is not None:
+            self.tracer.begin(operation)
+        try:
+            if self.latches is None:
+                yield
+                return
+            with self.writer_lock:
+                if exclusive:
+                    self.latches.tree.acquire_exclusive()
+                else:
+                    self.latches.tree.acquire_shared()
+                try:
+                    yield
+                finally:
+                    self._release_write_latches()
+                    if exclusive:
+                        self.latches.tree.release_exclusive()
+                    else:
+                        self.latches.tree.release_shared()
+        finally:
+            if self.tracer is not None:
+                self.tracer.end()
+
+    @contextmanager
+    def _reading(self, operation=None):
+        # batches of a range are traced by iter_from
+        if operation is not None and self.tracer is not None:
+            self.tracer.begin(operation)
+        try:
+            if self.latches is None:
+                yield
+                return
+            self.latches.tree.acquire_shared()
+            try:
+                yield
+            finally:
+                self.latches.tree.release_shared()
+        finally:
+            if operation is not None and self.tracer is not None:
+                self.tracer.end()
+
+    def _store_node(self, node):
+        if self.tracer is not None:
+            start = time.perf_counter()
+        # page may only overwrite the index file once its log records are durable
+        self.wal.sync()
+        for index, data in self._encode(node):
+            self.pager.write_page(index, data)
             self.write_operations += 1
-            return node
+            self.bytes_written += self.pager.page_size
+        if self.tracer is not None:
+            self.tracer.record("node_write", time.perf_counter() - start)
 
-    @staticmethod
-    def delete_node(node):
-        os.remove(f"tree_structure/{node.index}.txt")
-        del node
+    def _load_node(self, node_index):
+        if self.tracer is not None:
+            start = time.perf_counter()
+        self.read_operations += 1
+        data = self.pager.read_page(node_index)
+        self.bytes_read += self.pager.page_size
+        if self.codec == "fixed":
+            node = BTreeNode.from_bytes(node_index, data)
+        else:
+            node = BTreeNode(self.t, node_index)
+            next_index, = PAGE_HEADER.unpack_from(data)
+            data = data[PAGE_HEADER.size:]
+            while next_index != -1:
+                node.overflow.append(next_index)
+                page = self.pager.read_page(next_index)
+                self.read_operations += 1
+                self.bytes_read += self.pager.page_size
+                next_index, = PAGE_HEADER.unpack_from(page)
+                data += page[PAGE_HEADER.size:]
+            decode_node(node, data)
+        if self.tracer is not None:
+            self.tracer.record("node_read", time.perf_counter() - start)
+        return node
+
+    def _encode(self, node):
+        # (page index, bytes) of the pages of the node, overflow pages of a compact node
+        # are taken or released as its size changes
+        if self.codec == "fixed":
+            return [(node.index, node.to_bytes())]
+        data = encode_node(node, self.codec == "compact-zlib")
+        chunk = self.pager.page_size - PAGE_HEADER.size
+        pages = max(1, -(-len(data) // chunk))
+        while len(node.overflow) < pages - 1:
+            node.overflow.append(self.allocate_node_index())
+        while len(node.overflow) > pages - 1:
+            self.pager.free_page(node.overflow.pop())
+        indexes = [node.index] + node.overflow
+        return [(index, PAGE_HEADER.pack(indexes[i + 1] if i + 1 < pages else -1) + data[i * chunk:(i + 1) * chunk])
+                for i, index in enumerate(indexes)]
+
+    def allocate_node_index(self):
+        index = self.pager.reuse_page()
+        if index is not None:
+            return index
+        index = self.index_for_node
+        self.index_for_node += 1
+        return index
+
+    def delete_node(self, node):
+        self.buffer_pool.discard(node.index)
+        self.pager.free_page(node.index)
+        for index in node.overflow:
+            self.pager.free_page(index)
+        node.overflow = []
+
+    def commit(self):
+        self._log_commit()
+        if self.wal.size >= self.checkpoint_bytes:
+            self.flush()
+
+    def _log_commit(self, replace=None, compacting=None):
+        # logs pages changed by the finished operation as one unit, an operation that
+        # changed nothing is not logged
+        if not self.buffer_pool.uncommitted and replace is None and compacting is None:
+            return
+        pages = [page for node in self.buffer_pool.take_uncommitted() for page in self._encode(node)]
+        self.wal.commit(pages, {
+            "root": self.root,
+            "index_for_node": self.index_for_node,
+            "free_head": self.pager.free_head,
+            "free_pages": self.pager.free_pages,
+            "main_file_path": self.main_file_path,
+            "replace": replace,
+            # (copy, last key pointed at it) of an unfinished compaction
+            "compacting": compacting,
+        })
+        self.buffer_pool.shrink()
+
+    def _commit_part(self):
+        # a long batch commits the operations it finished once it has changed as many pages
+        # as the buffer pool holds, so they can be evicted
+        if len(self.buffer_pool.uncommitted) >= self.buffer_pool.capacity:
+            self.commit()
+
+    def _sync_main_file(self):
+        # records have to be durable before the log entries pointing at them
+        if self.main_file is not None:
+            self.main_file.sync()
+
+    def flush(self):
+        # checkpoint: every page and the superblock go to the index file and the log is emptied
+        with self.writer_lock:
+            if self.tracer is not None:
+                self.tracer.begin("flush")
+            try:
+                if self.main_file is not None:
+                    self.main_file.flush()
+                self.wal.sync()
+                self.buffer_pool.flush()
+                self.buffer_pool.uncommitted.clear()
+                # the filter is saved first, a newer filter only holds extra keys
+                if self.bloom is not None:
+                    self.bloom.save(self.bloom_path, self.root, self.index_for_node)
+                elif os.path.exists(self.bloom_path):
+                    # keys inserted without the filter would be missing from it
+                    os.remove(self.bloom_path)
+                self.pager.write_metadata(self.t, self.root, self.index_for_node, self.main_file_path)
+                self.pager.sync()
+                self.wal.truncate()
+            finally:
+                if self.tracer is not None:
+                    self.tracer.end()
+
+    def close(self):
+        with self._writing("close", exclusive=True):
+            self.flush()
+            self.wal.close()
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+            self.pager.close()
+            if self.main_file is not None:
+                self.main_file.close()
+            for snapshot in self.snapshots:
+                snapshot.release()
+            for index in self.secondary_indexes.values():
+                index.close()
@@ -0,0 +1,185 @@
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import nullcontext
+
+
+class LRUPolicy:
+    def __init__(self):
+        self.order = OrderedDict()
+
+    def add(self, index):
+        self.order[index] = None
+
+    def touch(self, index):
+        self.order.move_to_end(index)
+
+    def remove(self, index):
+        self.order.pop(index, None)
+
+    def victim(self, evictable):
+        for index in self.order:
+            if evictable(index):
+                return index
+        return None
+
+
+class ClockPolicy:
+    def __init__(self):
+        self.slots = []
+        self.position = {}
+        self.referenced = {}
+        self.empty_slots = []
+        self.hand = 0
+
+    def add(self, index):
+        if self.empty_slots:
+            position = self.empty_slots.pop()
+            self.slots[position] = index
+        else:
+            position = len(self.slots)
+            self.slots.append(index)
+        self.position[index] = position
+        self.referenced[index] = True
+
+    def touch(self, index):
+        self.referenced[index] = True
+
+    def remove(self, index):
+        position = self.position.pop(index, None)
+        if position is None:
+            return
+        self.slots[position] = None
+        self.empty_slots.append(position)
+        del self.referenced[index]
+
+    def victim(self, evictable):
+        # two sweeps: the first one may only clear reference bits
+        for _ in range(2 * len(self.slots)):
+            index = self.slots[self.hand]
+            self.hand = (self.hand + 1) % len(self.slots)
+            if index is None or not evictable(index):
+                continue
+            if self.referenced[index]:
+                self.referenced[index] = False
+                continue
+            return index
+        return None
+
+
+POLICIES = {"lru": LRUPolicy, "clock": ClockPolicy}
+
+
+class BufferPool:
+    def __init__(self, load, store, capacity=128, policy="lru", thread_safe=False):
+        if capacity < 1:
+            raise ValueError("Buffer pool capacity has to be at least one page")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.load = load
+        self.store = store
+        self.capacity = capacity
+        self.policy = POLICIES[policy]()
+        self.frames = {}
+        self.dirty = set()
+        # pages modified by the running operation, kept in memory until it commits
+        self.uncommitted = set()
+        # pages latched by the writer, they may be half modified
+        self.pinned = set()
+        self.lock = threading.Lock() if thread_safe else nullcontext()
+        # nodes still referenced by the tree code after eviction, keeps one object per page
+        self.nodes = weakref.WeakValueDictionary()
+        # counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index):
+        with self.lock:
+            node = self.frames.get(index)
+            if node is not None:
+                self.hits += 1
+                self.policy.touch(index)
+                return node
+
+            node = self.nodes.get(index)
+            if node is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                node = self.load(index)
+            self._admit(node)
+            return node
+
+    def cached(self, index):
+        # no load is needed for the page
+        return index in self.frames or index in self.nodes
+
+    def holds(self, node):
+        # the node is the page of its index, not one discarded since it was read
+        with self.lock:
+            return self.nodes.get(node.index) is node
+
+    def put(self, node):
+        with self.lock:
+            if self.frames.get(node.index) is not node:
+                self._discard(node.index)
+                self._admit(node)
+            else:
+                self.policy.touch(node.index)
+            self.dirty.add(node.index)
+            self.uncommitted.add(node.index)
+
+    def take_uncommitted(self):
+        with self.lock:
+            nodes = [self.frames[index] for index in sorted(self.uncommitted)]
+            self.uncommitted.clear()
+            return nodes
+
+    def shrink(self):
+        # pages kept for an operation beyond the capacity are evicted once it is logged
+        with self.lock:
+            while len(self.frames) > self.capacity and self._evict():
+                pass
+
+    def pin(self, index):
+        with self.lock:
+            self.pinned.add(index)
+
+    def unpin(self, index):
+        with self.lock:
+            self.pinned.discard(index)
+
+    def discard(self, index):
+        with self.lock:
+            self._discard(index)
+
+    def flush(self):
+        with self.lock:
+            for index in sorted(self.dirty):
+                self.store(self.frames[index])
+            self.dirty.clear()
+
+    def _discard(self, index):
+        if self.frames.pop(index, None) is not None:
+            self.policy.remove(index)
+        self.nodes.pop(index, None)
+        self.dirty.discard(index)
+        self.uncommitted.discard(index)
+
+    def _admit(self, node):
+        while len(self.frames) >= self.capacity and self._evict():
+            pass
+        self.frames[node.index] = node
+        self.nodes[node.index] = node
+        self.policy.add(node.index)
+
+    def _evict(self):
+        index = self.policy.victim(lambda candidate: candidate not in self.uncommitted and candidate not in self.pinned)
+        if index is None:
+            return False
+        if index in self.dirty:
+            self.store(self.frames[index])
+            self.dirty.remove(index)
+        del self.frames[index]
+        self.policy.remove(index)
+        return True
@@ -0,0 +1,201 @@
+import heapq
+import os
+import shutil
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from record_file import MAGIC, RECORD_HEADER, RecordFile
+
+# pairs read from a sorted run file at once
+RUN_BLOCK = 8192
+# bytes of a text file parsed by one process at a time
+CHUNK_SIZE = 32 * 1024 * 1024
+
+
+def read_records(path):
+    # (key, offset) of every live record in a data file
+    records = RecordFile(path)
+    for offset, flag, key, _ in records.scan():
+        if flag == 1:
+            yield key, offset
+    records.close()
+
+
+def sort_records(records, run_size=1_000_000):
+    # returns number of unique keys and their (key, offset) pairs in key order,
+    # runs that do not fit in memory are sorted separately and merged from temporary files
+    runs = []
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= run_size:
+            chunk.sort()
+            runs.append(_write_run(chunk)[0])
+            chunk = []
+    chunk.sort()
+
+    if not runs:
+        unique = list(_unique(chunk))
+        return len(unique), iter(unique)
+
+    runs.append(_write_run(chunk)[0])
+    merged, count = _write_run(_unique(heapq.merge(*(_read_run(run) for run in runs))))
+    for run in runs:
+        run.close()
+    return count, _read_run(merged, close=True)
+
+
+def sort_text_file(text_path, record_path, workers=None, chunk_size=CHUNK_SIZE):
+    # converts a "flag: key: value" text file to a record file like convert_text_file and returns
+    # the number of unique live keys and their (key, offset) pairs in key order, chunks of the text
+    # are parsed and sorted by separate processes and their runs are merged
+    size = os.path.getsize(text_path)
+    workers = workers or os.cpu_count()
+    bounds = _line_bounds(text_path, max(workers, -(-size // chunk_size)))
+    segments = [f"{record_path}.part{i}" for i in range(len(bounds))]
+    with ProcessPoolExecutor(workers) as executor:
+        chunks = list(executor.map(_parse_chunk, [text_path] * len(bounds), bounds, segments))
+
+    # segments are joined in file order, so offsets only move by the size of those before them
+    runs = []
+    with open(record_path, 'wb') as records:
+        records.write(MAGIC)
+        for segment, (keys, offsets) in zip(segments, chunks):
+            runs.append(_shifted(keys, offsets, records.tell()))
+            with open(segment, 'rb') as file:
+                shutil.copyfileobj(file, records)
+            os.remove(segment)
+    merged, count = _write_run(_unique(heapq.merge(*runs)))
+    return count, _read_run(merged, close=True)
+
+
+def _line_bounds(path, parts):
+    # (start, end) of parts of the file of about equal size, each ends after a newline
+    size = os.path.getsize(path)
+    bounds = []
+    start = 0
+    with open(path, 'rb') as file:
+        for i in range(1, parts + 1):
+            end = size * i // parts
+            if end < size:
+                file.seek(end)
+                file.readline()
+                end = file.tell()
+            if end > start:
+                bounds.append((start, end))
+                start = end
+    return bounds
+
+
+def _parse_chunk(text_path, bounds, segment_path):
+    # writes the records of the lines to a segment and returns the keys and segment offsets
+    # of the live records in key order, as bytes of 64-bit arrays
+    start, end = bounds
+    with open(text_path, 'rb') as file:
+        file.seek(start)
+        lines = file.read(end - start).decode().split('\n')
+    data = bytearray()
+    keys = array('q')
+    offsets = array('q')
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.strip().split(':')
+        if len(fields) == 2:
+            fields.insert(0, '1')
+        flag, key, value = fields
+        flag, key, value = int(flag), int(key), value.strip().encode()
+        if flag == 1:
+            keys.append(key)
+            offsets.append(len(data))
+        data += RECORD_HEADER.pack(flag, key, len(value))
+        data += value
+    with open(segment_path, 'wb') as segment:
+        segment.write(data)
+
+    # stable, the first record of a repeated key stays first
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return array('q', [keys[i] for i in order]).tobytes(), array('q', [offsets[i] for i in order]).tobytes()
+
+
+def _shifted(keys, offsets, base):
+    sorted_keys = array('q')
+    sorted_keys.frombytes(keys)
+    segment_offsets = array('q')
+    segment_offsets.frombytes(offsets)
+    for key, offset in zip(sorted_keys, segment_offsets):
+        yield key, offset + base
+
+
+def _unique(records):
+    # keep the first record of every key, as insert ignores duplicates
+    previous = None
+    for key, offset in records:
+        if key != previous:
+            previous = key
+            yield key, offset
+
+
+def _write_run(records):
+    run = tempfile.TemporaryFile()
+    count = 0
+    block = array('q')
+    for key, offset in records:
+        block.append(key)
+        block.append(offset)
+        if len(block) >= 2 * RUN_BLOCK:
+            count += len(block) // 2
+            block.tofile(run)
+            del block[:]
+    count += len(block) // 2
+    block.tofile(run)
+    run.seek(0)
+    return run, count
+
+
+def _read_run(run, close=False):
+    while True:
+        block = array('q')
+        block.frombytes(run.read(2 * RUN_BLOCK * block.itemsize))
+        if not block:
+            break
+        for i in range(0, len(block), 2):
+            yield block[i], block[i + 1]
+    if close:
+        run.close()
+
+
+def _spread(total, parts):
+    # split total into parts differing by at most one
+    base, extra = divmod(total, parts)
+    return [base + 1 if i < extra else base for i in range(parts)]
+
+
+class TreePlan:
+    # shape of a tree packed bottom-up: keys per leaf, children per internal node
+    # and subtree sizes, so that every node gets its post-order page index in advance;
+    # keys of a B+ tree all go to leaves, separators are copies of them
+    def __init__(self, count, capacity, bplus=False):
+        if bplus:
+            leaves = max(1, -(-count // capacity))
+            self.leaf_keys = _spread(count, leaves)
+        else:
+            leaves = -(-(count + 1) // (capacity + 1))
+            self.leaf_keys = _spread(count - leaves + 1, leaves)
+        self.first_child = [None]
+        self.sizes = [[1] * leaves]
+
+        nodes = leaves
+        while nodes > 1:
+            parents = -(-nodes // (capacity + 1))
+            first_child = [0]
+            for children in _spread(nodes, parents):
+                first_child.append(first_child[-1] + children)
+            lower = self.sizes[-1]
+            self.first_child.append(first_child)
+            self.sizes.append([1 + sum(lower[first_child[i]:first_child[i + 1]]) for i in range(parents)])
+            nodes = parents
+
+        self.height = len(self.sizes)
+        self.nodes = self.sizes[-1][0]
@@ -0,0 +1,100 @@
+import struct
+import sys
+import zlib
+from array import array
+
+# node page encodings, the position in the tuple is stored in the superblock
+CODECS = ("fixed", "compact", "compact-zlib")
+# compact pages start with the index of the page the node continues on, -1 if none
+PAGE_HEADER = struct.Struct("<q")
+# flags, number of keys, number of children, low bytes kept of every key, offset and child, first key,
+# next leaf of a B+ tree
+NODE_HEADER = struct.Struct("<BIIBBBqq")
+LEAF = 1
+COMPRESSED = 2
+# internal nodes of a B+ tree hold no offsets
+NO_OFFSETS = 4
+# sizes a compact node is planned with: keys of a node sharing all but 3 bytes, 4 byte offsets
+# and children, a node that does not fit its page continues on overflow pages
+ENTRY_SIZE = 3 + 4 + 4
+# B+ leaves hold no children and internal nodes no offsets
+BPLUS_ENTRY_SIZE = 3 + 4
+NODE_OVERHEAD = PAGE_HEADER.size + NODE_HEADER.size + 4
+ZERO = bytes(8)
+
+
+def capacity(page_size, bplus=False):
+    # keys of a compact node planned for the page size
+    return (page_size - NODE_OVERHEAD) // (BPLUS_ENTRY_SIZE if bplus else ENTRY_SIZE)
+
+
+def byte_width(value):
+    # bytes below the highest set bit of a non-negative value
+    return (value.bit_length() + 7) // 8
+
+
+def pack(values, width):
+    # low width bytes of every value, copied with slice assignments instead of a loop over values
+    raw = values.tobytes() if sys.byteorder == "little" else _swapped(values)
+    count = len(values)
+    packed = bytearray(width * count)
+    for i in range(width):
+        packed[i::width] = raw[i::8]
+    return packed
+
+
+def unpack(data, start, width, count, high=ZERO):
+    # values from their low width bytes, the bytes above are taken from high
+    end = start + width * count
+    raw = bytearray(8 * count)
+    for i in range(width):
+        raw[i::8] = data[start + i:end:width]
+    for i in range(width, 8):
+        if high[i]:
+            raw[i::8] = high[i:i + 1] * count
+    values = array('q')
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, end
+
+
+def _swapped(values):
+    values = array('q', values)
+    values.byteswap()
+    return values.tobytes()
+
+
+def encode_node(node, compress=False):
+    # sorted keys of a node share their high bytes with the first key, only the low bytes
+    # that differ are kept; offsets and children keep the bytes below their maximum;
+    # leaves may be compressed with zlib
+    keys = node.keys
+    first_key = keys[0] if keys else 0
+    key_width = byte_width((first_key ^ keys[-1]) & 0xFFFFFFFFFFFFFFFF) if keys else 0
+    offset_width = byte_width(max(node.offsets, default=0))
+    child_width = byte_width(max(node.children, default=0))
+    flags = LEAF if node.is_leaf else 0
+    if keys and not node.offsets:
+        flags |= NO_OFFSETS
+    body = NODE_HEADER.pack(flags, len(keys), len(node.children), key_width, offset_width, child_width, first_key,
+                            node.next) \
+        + pack(keys, key_width) + pack(node.offsets, offset_width) + pack(node.children, child_width)
+    if compress and node.is_leaf:
+        compressed = zlib.compress(body, 1)
+        if len(compressed) + 1 < len(body):
+            return bytes([flags | COMPRESSED]) + compressed
+    return body
+
+
+def decode_node(node, data):
+    # fills the node from the bytes made by encode_node, padding after them is ignored
+    if data[0] & COMPRESSED:
+        data = zlib.decompressobj().decompress(data[1:])
+    flags, keys_count, children_count, key_width, offset_width, child_width, first_key, node.next = \
+        NODE_HEADER.unpack_from(data)
+    node.is_leaf = bool(flags & LEAF)
+    node.keys, position = unpack(data, NODE_HEADER.size, key_width, keys_count, struct.pack("<q", first_key))
+    node.offsets, position = unpack(data, position, offset_width, 0 if flags & NO_OFFSETS else keys_count)
+    node.children, _ = unpack(data, position, child_width, children_count)
+    return node
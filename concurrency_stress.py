@@ -0,0 +1,152 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from btree import BTree
+
+
+def check_structure(tree):
+    # every leaf at one depth, no empty or overfull node, children around every key
+    depths = set()
+    stack = [(tree.root, 0, True)]
+    while stack:
+        node_index, depth, is_root = stack.pop()
+        node = tree.read_node_from_drive(node_index)
+        if len(node.keys) > tree.t or (not is_root and not node.keys):
+            return f"page {node_index} holds {len(node.keys)} keys"
+        if list(node.keys) != sorted(set(node.keys)):
+            return f"keys of page {node_index} are out of order"
+        if node.is_leaf:
+            depths.add(depth)
+        elif len(node.children) != len(node.keys) + 1:
+            return f"page {node_index} has {len(node.children)} children for {len(node.keys)} keys"
+        for child in node.children:
+            stack.append((child, depth + 1, False))
+    if len(depths) > 1:
+        return f"leaves at depths {sorted(depths)}"
+    return None
+
+
+def run(threads, operations, key_space, t, pool_capacity, seed):
+    # even keys are loaded up front and never touched by the writer, odd keys are
+    # inserted and deleted while readers search and scan the tree
+    directory = tempfile.mkdtemp()
+    data_path = os.path.join(directory, "data.rec")
+    tree = BTree(data_path, t=t, index_path=os.path.join(directory, "index.idx"),
+                 pool_capacity=pool_capacity, group_commit_ops=256, thread_safe=True)
+    stable = list(range(0, key_space, 2))
+    tree.insert_many((key, f"v{key}") for key in stable)
+    stable_set = set(stable)
+
+    errors = []
+    counts = {"writes": 0, "searches": 0, "ranges": 0, "traversals": 0}
+    done = threading.Event()
+    reference = set(stable)
+
+    def fail(message):
+        errors.append(message)
+        done.set()
+
+    def guarded(target):
+        # an exception in a worker fails the run instead of ending the thread quietly
+        def run_target(*args):
+            try:
+                target(*args)
+            except Exception as error:
+                fail(f"{target.__name__}: {error!r}")
+        return run_target
+
+    def writer():
+        random_ = random.Random(seed)
+        for _ in range(operations):
+            if done.is_set():
+                return
+            key = random_.randrange(1, key_space, 2)
+            if key not in reference:
+                tree.insert(key, f"v{key}")
+                reference.add(key)
+            else:
+                tree.delete(key)
+                reference.discard(key)
+            counts["writes"] += 1
+        done.set()
+
+    def reader(number):
+        random_ = random.Random(seed + number + 1)
+        while not done.is_set():
+            if random_.random() < 0.7:
+                key = random_.randrange(-key_space, 2 * key_space)
+                _, status = tree.search(key)
+                if key in stable_set and status != "found":
+                    return fail(f"stable key {key} not found")
+                if (key < 0 or key >= key_space) and status != "not found":
+                    return fail(f"key {key} found outside of the key space")
+                counts["searches"] += 1
+            else:
+                lo = random_.randrange(key_space)
+                hi = lo + random_.randrange(1, 64)
+                keys = [key for key, _ in tree.range(lo, hi)]
+                if keys != sorted(set(keys)) or any(key < lo or key > hi for key in keys):
+                    return fail(f"range({lo}, {hi}) returned {keys}")
+                missing = [key for key in range(lo + lo % 2, min(hi, key_space - 1) + 1, 2) if key not in keys]
+                if missing:
+                    return fail(f"range({lo}, {hi}) misses stable keys {missing}")
+                counts["ranges"] += 1
+
+    def checker():
+        while not done.is_set():
+            keys = tree.traverse()
+            if keys != sorted(set(keys)) or not stable_set.issubset(keys):
+                return fail("traverse() lost stable keys or is out of order")
+            counts["traversals"] += 1
+            time.sleep(0.05)
+
+    workers = [threading.Thread(target=guarded(writer)), threading.Thread(target=guarded(checker))]
+    workers += [threading.Thread(target=guarded(reader), args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+
+    if not errors:
+        if tree.traverse() != sorted(reference):
+            errors.append("traverse() differs from the applied operations")
+        elif [key for key, _ in tree.range(-1, key_space)] != sorted(reference):
+            errors.append("range() differs from traverse()")
+        else:
+            problem = check_structure(tree)
+            if problem is not None:
+                errors.append(problem)
+    # latches are dropped once no thread holds or waits for them
+    if tree.write_latched or tree.latches.latches:
+        errors.append("latches left held after the run")
+    tree.close()
+    shutil.rmtree(directory)
+
+    print(f"{threads} readers, {seconds:.2f} s: {counts['writes']} writes, {counts['searches']} searches, "
+          f"{counts['ranges']} ranges, {counts['traversals']} traversals")
+    for error in errors:
+        print("ERROR:", error)
+    return not errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mixed reader/writer workload on a thread-safe B-tree")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--keys", type=int, default=2000)
+    parser.add_argument("--t", type=int, default=4)
+    parser.add_argument("--pool", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # frequent thread switches make interleavings more likely
+    sys.setswitchinterval(1e-4)
+    ok = run(args.threads, args.operations, args.keys, args.t, args.pool, args.seed)
+    sys.exit(0 if ok else 1)
@@ -15,6 +15,7 @@ def generate_records(file_name, num_records):
     print(f"Plik '{file_name}' został wygenerowany z {num_records} rekordami.")
 
 
-filename = input("Podaj nazwę pliku: ")
-size = int(input("Podaj wielkość pliku: "))
-generate_records(f"data/{filename}.txt", size)
+if __name__ == '__main__':
+    filename = input("Podaj nazwę pliku: ")
+    size = int(input("Podaj wielkość pliku: "))
+    generate_records(f"data/{filename}.txt", size)
@@ -0,0 +1,80 @@
+import threading
+
+# key of the latch guarding the root pointer, pages use their index
+ROOT = -1
+
+
+class RWLatch:
+    # many readers or one writer, a waiting writer holds back new readers
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        # threads holding or waiting for the latch, counted by LatchTable
+        self.users = 0
+
+    def acquire_shared(self):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_shared(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_exclusive(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_exclusive(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+class LatchTable:
+    # read/write latch of every page in use, created on first use and dropped when the last
+    # thread holding or waiting for it releases it; the writer mutex lets one insert or
+    # delete run at a time and the tree latch is taken exclusively by operations rewriting
+    # the whole tree
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latches = {}
+        self.writer = threading.RLock()
+        self.tree = RWLatch()
+
+    def acquire(self, index, exclusive=False):
+        while True:
+            latch = self.latches.get(index)
+            if latch is None:
+                with self.lock:
+                    latch = self.latches.setdefault(index, RWLatch())
+            # the count is kept under the lock of the latch, a latch dropped after the lookup
+            # is replaced by a new one
+            with latch.condition:
+                if self.latches.get(index) is latch:
+                    latch.users += 1
+                    break
+        if exclusive:
+            latch.acquire_exclusive()
+        else:
+            latch.acquire_shared()
+
+    def release(self, index, exclusive=False):
+        latch = self.latches[index]
+        if exclusive:
+            latch.release_exclusive()
+        else:
+            latch.release_shared()
+        with latch.condition:
+            latch.users -= 1
+            if latch.users == 0:
+                del self.latches[index]
@@ -1,22 +1,49 @@
+import argparse
+import os
+import sys
+
 from btree import *
+from record_file import RecordFile, convert_text_file
+from replay import replay
+
 
+def open_data_file(file_path):
+    # text data files are converted once, later runs use the record file
+    if RecordFile.is_record_file(file_path):
+        return file_path
+    record_path = os.path.splitext(file_path)[0] + ".rec"
+    if not os.path.exists(record_path):
+        convert_text_file(file_path, record_path)
+    return record_path
 
-def parse_file(file_path, btree):
-    with open(file_path, 'r') as file:
-        offset = file.tell()
-        line = file.readline()
-        while line:
-            flag, key, _ = line.strip().split(':')
-            key = int(key)
-            if flag == '1':
-                btree.insert(key, offset, loading_file=True)
-            offset = file.tell()
-            line = file.readline()
-    return btree
+def index_path_of(file_path):
+    return f"tree_structure/{os.path.splitext(os.path.basename(file_path))[0]}.idx"
 
-def delete_node_files(tree):
-    for index in range(tree.index_for_node):
-        os.remove(f"tree_structure/{index}.txt")
+def open_tree(file_path, page_size=None, codec="fixed", layout="btree"):
+    # reopen the index saved by a previous run instead of loading the data file again,
+    # page size, codec and layout only apply to a new index
+    index_path = index_path_of(file_path)
+    if os.path.exists(index_path):
+        try:
+            tree = BTree.open(index_path)
+        except ValueError:
+            tree = None
+        if tree is not None and tree.main_file_path == file_path:
+            return tree
+        if tree is not None:
+            tree.close()
+    tree = BTree(index_path=index_path, page_size=page_size, codec=codec, layout=layout)
+    tree.bulk_load(file_path)
+    return tree
+
+def open_data(file_path, page_size=None, codec="fixed", workers=None, layout="btree"):
+    # tree of a data file, with workers a text file without its record file is converted
+    # and indexed by that many processes
+    record_path = os.path.splitext(file_path)[0] + ".rec"
+    if workers and not RecordFile.is_record_file(file_path) and not os.path.exists(record_path):
+        tree = BTree(index_path=index_path_of(record_path), page_size=page_size, codec=codec, layout=layout)
+        return tree.bulk_load_text(file_path, record_path, workers=workers)
+    return open_tree(open_data_file(file_path), page_size, codec, layout)
 
 def parse_command(command, tree):
     option = command[0]
@@ -27,8 +54,10 @@ def parse_command(command, tree):
             print(f"Inserted ({key}, {value})")
         case '2':
             _, key = command.strip().split(';')
-            tree.delete(int(key))
-            print(f"Deleted ({key})")
+            if tree.delete(int(key)):
+                print(f"Deleted ({key})")
+            else:
+                print(f"Not found {key} in tree.")
         case '3':
             _, key = command.strip().split(';')
             found_node, status = tree.search(int(key))
@@ -42,13 +71,52 @@ def parse_command(command, tree):
             _, key, value = command.strip().split(';')
             tree.delete(int(key))
             tree.insert(int(key), value)
-    print(f"Operations: read operations: {tree.read_operations}, write operations: {tree.write_operations}")
+    print(f"Operations: read operations: {tree.read_operations}, write operations: {tree.write_operations}, "
+          f"buffer hits: {tree.buffer_pool.hits}, buffer misses: {tree.buffer_pool.misses}")
+
+def run_replay(args):
+    # non-interactive mode: applies the instruction file and prints a summary
+    tree = open_data(args.data, args.page_size, args.codec, args.workers, args.layout)
+    results = open(args.results, 'w') if args.results else None
+    try:
+        with open(args.replay, 'r') as file:
+            summary = replay(tree, file, results)
+    finally:
+        if results is not None:
+            results.close()
+        tree.close()
+    print(f"Replayed {summary['commands']} commands in {summary['batches']} batches "
+          f"in {summary['seconds']:.3f} s")
+    print(f"Inserted: {summary['inserted']}, deleted: {summary['deleted']} "
+          f"(not found: {summary['missing_deletes']}), found: {summary['found']} "
+          f"(not found: {summary['missing_searches']}), updated: {summary['updated']}, "
+          f"displayed: {summary['displayed']}")
+    print(f"Operations: read operations: {tree.read_operations}, write operations: {tree.write_operations}, "
+          f"buffer hits: {tree.buffer_pool.hits}, buffer misses: {tree.buffer_pool.misses}")
 
 if __name__ == '__main__':
-    tree = BTree(t=4)
-    filepath = f"data/{input("Enter file name: ")}"
-    tree.main_file_path = filepath
-    parse_file(filepath, tree)
+    parser = argparse.ArgumentParser(description="B-tree file organization")
+    parser.add_argument("--replay", help="instruction file applied without the menu")
+    parser.add_argument("--data", help="data file of the tree")
+    parser.add_argument("--results", help="file for the result of every replayed command")
+    parser.add_argument("--page-size", type=int, help="page size in bytes of a new index, t is then the number "
+                                                      "of keys that fit, 4 without it")
+    parser.add_argument("--codec", default="fixed", help="node page encoding of a new index: fixed, compact or "
+                                                         "compact-zlib")
+    parser.add_argument("--workers", type=int, help="processes converting and indexing a new text data file")
+    parser.add_argument("--layout", default="btree", help="node layout of a new index: btree or bplus")
+    args = parser.parse_args()
+    if args.replay is not None:
+        if args.data is None:
+            parser.error("--replay requires --data")
+        try:
+            run_replay(args)
+        except ValueError as error:
+            sys.exit(f"{args.replay}: {error}")
+        sys.exit(0)
+
+    tree = open_data(args.data if args.data else f"data/{input('Enter file name: ')}", args.page_size, args.codec,
+                     args.workers, args.layout)
     print("File parsed successfully.")
     while True:
         option = input("Choose an option:\n"
@@ -62,6 +130,7 @@ if __name__ == '__main__':
                        "Enter your choice: ")
         print("Write operations:", tree.write_operations)
         print("Read operations:", tree.read_operations)
+        print("Buffer hits:", tree.buffer_pool.hits, "misses:", tree.buffer_pool.misses)
         match option:
             case "1":
                 key = int(input("Enter key: "))
@@ -70,8 +139,10 @@ if __name__ == '__main__':
                 print(f"Inserted ({key}, {value})")
             case "2":
                 key = int(input("Enter key: "))
-                tree.delete(key)
-                print(f"Deleted ({key})")
+                if tree.delete(key):
+                    print(f"Deleted ({key})")
+                else:
+                    print(f"Not found {key} in tree.")
             case "3":
                 key = int(input("Enter key: "))
                 found_node, status = tree.search(key)
@@ -93,7 +164,7 @@ if __name__ == '__main__':
                     for line in file:
                         parse_command(line, tree)
             case "7":
-                delete_node_files(tree)
+                tree.close()
                 exit(0)
 
         input("Press Enter to continue...")
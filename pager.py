@@ -0,0 +1,107 @@
+import os
+import struct
+
+MAGIC = b"BTIDX\0\0\1"
+FORMAT_VERSION = 4
+# node pages start after the superblock
+SUPERBLOCK_SIZE = 4096
+# magic, version, page size, node codec, node layout, t, root, pages in file, first free page,
+# main file path length
+SUPERBLOCK = struct.Struct("<8sIIBBIqqqH")
+# released pages hold -1 in place of t and the index of the next free page
+FREE_PAGE = struct.Struct("<iq")
+
+
+class Pager:
+    def __init__(self, path, page_size, file=None, codec=0, layout=0):
+        self.path = path
+        self.page_size = page_size
+        # position of the node encoding in codec.CODECS
+        self.codec = codec
+        # position of the node layout in btree.LAYOUTS
+        self.layout = layout
+        # first page of the free list saved in the index file
+        self.free_head = -1
+        # pages released since the free list was saved, reused first
+        self.free_pages = []
+
+        if file is None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            file = open(path, "w+b")
+        self.file = file
+
+    @staticmethod
+    def open(path):
+        # returns the pager of an existing index file and its metadata
+        file = open(path, "r+b")
+        data = file.read(SUPERBLOCK_SIZE)
+        if len(data) < SUPERBLOCK.size or data[:len(MAGIC)] != MAGIC:
+            file.close()
+            raise ValueError(f"{path} is not an index file")
+        _, version, page_size, codec, layout, t, root, pages, free_head, path_length = SUPERBLOCK.unpack_from(data)
+        if version != FORMAT_VERSION:
+            file.close()
+            raise ValueError(f"Unsupported index format version {version}")
+
+        pager = Pager(path, page_size, file, codec, layout)
+        pager.free_head = free_head
+        main_file_path = data[SUPERBLOCK.size:SUPERBLOCK.size + path_length].decode() or None
+        metadata = {"t": t, "root": root, "index_for_node": pages, "main_file_path": main_file_path}
+        return pager, metadata
+
+    def write_metadata(self, t, root, index_for_node, main_file_path):
+        self.save_free_pages()
+        path = (main_file_path or "").encode()
+        header = SUPERBLOCK.pack(MAGIC, FORMAT_VERSION, self.page_size, self.codec, self.layout, t, root, index_for_node,
+                                 self.free_head, len(path))
+        if len(header) + len(path) > SUPERBLOCK_SIZE:
+            raise ValueError("Main file path does not fit in the superblock")
+        os.pwrite(self.file.fileno(), header + path, 0)
+
+    def read_page(self, index):
+        # positional reads and writes, pages may be loaded by several threads at once
+        data = os.pread(self.file.fileno(), self.page_size, SUPERBLOCK_SIZE + index * self.page_size)
+        if len(data) != self.page_size:
+            raise ValueError(f"Page {index} is out of range of {self.path}")
+        return data
+
+    def write_page(self, index, data):
+        if len(data) > self.page_size:
+            raise ValueError(f"Page {index} does not fit in {self.page_size} bytes")
+        os.pwrite(self.file.fileno(), data.ljust(self.page_size, b"\0"), SUPERBLOCK_SIZE + index * self.page_size)
+
+    def free_page(self, index):
+        self.free_pages.append(index)
+
+    def reuse_page(self):
+        # index of a released page or None
+        if self.free_pages:
+            return self.free_pages.pop()
+        if self.free_head == -1:
+            return None
+        index = self.free_head
+        marker, self.free_head = FREE_PAGE.unpack_from(self.read_page(index))
+        if marker != -1:
+            raise ValueError(f"Page {index} on the free list is in use")
+        return index
+
+    def clear_free_pages(self):
+        self.free_head = -1
+        self.free_pages.clear()
+
+    def save_free_pages(self):
+        # chain pages released since the last save in front of the saved list
+        for index in self.free_pages:
+            self.write_page(index, FREE_PAGE.pack(-1, self.free_head))
+            self.free_head = index
+        self.free_pages.clear()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
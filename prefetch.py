@@ -0,0 +1,44 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pager import SUPERBLOCK_SIZE
+
+
+class Prefetcher:
+    # read-ahead of pages a scan is going to read: the kernel is asked to load them into the
+    # page cache with posix_fadvise, where it is missing a background thread reads them and
+    # drops the bytes, so a later read never gets an outdated page
+    def __init__(self, pager, buffer_pool):
+        self.pager = pager
+        self.buffer_pool = buffer_pool
+        self.executor = None if hasattr(os, "posix_fadvise") else ThreadPoolExecutor(1)
+        # counters
+        self.requests = 0
+        self.pages = 0
+
+    def prefetch(self, indexes):
+        # pages in the buffer pool are skipped, consecutive pages are requested together
+        runs = []
+        for index in sorted(indexes):
+            if self.buffer_pool.cached(index):
+                continue
+            if runs and runs[-1][1] == index:
+                runs[-1][1] = index + 1
+            elif not runs or runs[-1][1] < index:
+                runs.append([index, index + 1])
+        fd = self.pager.file.fileno()
+        page_size = self.pager.page_size
+        for start, end in runs:
+            offset = SUPERBLOCK_SIZE + start * page_size
+            length = (end - start) * page_size
+            if self.executor is None:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+            else:
+                self.executor.submit(os.pread, fd, length, offset)
+            self.requests += 1
+            self.pages += end - start
+
+    def close(self):
+        # reads still running have to finish before the index file is closed
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,103 @@
+import mmap
+import os
+import struct
+
+MAGIC = b"BTREC\0\0\1"
+# live flag (1 - live, 0 - deleted), key, value length
+RECORD_HEADER = struct.Struct("<BqI")
+
+
+class RecordFile:
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+        self.file = open(path, 'r+b')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a record file")
+        # single handle for all appended records
+        self.append_handle = open(path, 'ab')
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    @staticmethod
+    def is_record_file(path):
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    def read(self, offset):
+        # zero-copy view of the value bytes
+        self._ensure_mapped(offset + RECORD_HEADER.size)
+        _, _, length = RECORD_HEADER.unpack_from(self.map, offset)
+        start = offset + RECORD_HEADER.size
+        self._ensure_mapped(start + length)
+        return memoryview(self.map)[start:start + length]
+
+    def append(self, key, value, flag=1):
+        offset = self.size
+        self.append_handle.write(RECORD_HEADER.pack(flag, key, len(value)))
+        self.append_handle.write(value)
+        self.size += RECORD_HEADER.size + len(value)
+        return offset
+
+    def delete(self, offset):
+        self._ensure_mapped(offset + 1)
+        self.map[offset] = 0
+
+    def scan(self):
+        # (offset, flag, key, value) of every record in file order
+        self._ensure_mapped(self.size)
+        offset = len(MAGIC)
+        while offset < self.size:
+            flag, key, length = RECORD_HEADER.unpack_from(self.map, offset)
+            start = offset + RECORD_HEADER.size
+            yield offset, flag, key, memoryview(self.map)[start:start + length]
+            offset = start + length
+
+    def _ensure_mapped(self, end):
+        if end <= len(self.map):
+            return
+        if end > self.size:
+            raise ValueError(f"Offset {end} is out of range of {self.path}")
+        self.append_handle.flush()
+        # views of the old mapping stay valid until they are released
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def flush(self):
+        self.append_handle.flush()
+        self.map.flush()
+
+    def sync(self):
+        self.flush()
+        os.fsync(self.append_handle.fileno())
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.append_handle.close()
+        try:
+            self.map.close()
+        except BufferError:
+            # values handed out as views keep the mapping alive
+            pass
+        self.file.close()
+
+
+def convert_text_file(text_path, record_path):
+    # "flag: key: value" lines (flag is optional) to a record file
+    if os.path.exists(record_path):
+        os.remove(record_path)
+    records = RecordFile(record_path)
+    with open(text_path, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            fields = line.strip().split(':')
+            if len(fields) == 2:
+                fields.insert(0, '1')
+            flag, key, value = fields
+            records.append(int(key), value.strip().encode(), flag=int(flag))
+    records.close()
+    return record_path
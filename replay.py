@@ -0,0 +1,100 @@
+import time
+from bisect import bisect_left
+
+INSERT = '1'
+DELETE = '2'
+SEARCH = '3'
+DISPLAY = '4'
+UPDATE = '5'
+# number of ';' separated fields of every command
+FIELDS = {INSERT: 3, DELETE: 2, SEARCH: 2, DISPLAY: 1, UPDATE: 3}
+
+
+def parse_instructions(file):
+    # (line number, command, key, value) of every non-empty line of an instruction file
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(';')
+        command = fields[0]
+        if command not in FIELDS or len(fields) != FIELDS[command]:
+            raise ValueError(f"Line {number}: malformed command: {line}")
+        key = None
+        if command != DISPLAY:
+            try:
+                key = int(fields[1])
+            except ValueError:
+                raise ValueError(f"Line {number}: malformed key: {line}") from None
+        yield number, command, key, fields[2] if len(fields) == 3 else None
+
+
+def split_batches(commands):
+    # consecutive commands of one kind, another kind or a repeated key starts a new batch
+    # so every key is changed in file order
+    batch = []
+    keys = set()
+    for command in commands:
+        kind, key = command[1], command[2]
+        if batch and (kind != batch[0][1] or kind == DISPLAY or key in keys):
+            yield batch
+            batch = []
+            keys = set()
+        batch.append(command)
+        keys.add(key)
+    if batch:
+        yield batch
+
+
+def replay(tree, file, results=None):
+    # applies an instruction file batch by batch, results of the commands are written
+    # to results in file order, returns the counts of the summary
+    summary = {"commands": 0, "batches": 0, "inserted": 0, "deleted": 0, "missing_deletes": 0, "found": 0,
+               "missing_searches": 0, "updated": 0, "displayed": 0}
+    start = time.perf_counter()
+    for batch in split_batches(parse_instructions(file)):
+        apply_batch(tree, batch, results, summary)
+        summary["commands"] += len(batch)
+        summary["batches"] += 1
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def apply_batch(tree, batch, results, summary):
+    kind = batch[0][1]
+    keys = [key for _, _, key, _ in batch]
+    lines = []
+    if kind == INSERT:
+        # the value of a key already in the tree is kept, as with single inserts
+        summary["inserted"] += tree.insert_many((key, value) for _, _, key, value in batch)
+        lines = [f"Inserted ({key}, {value})" for _, _, key, value in batch]
+    elif kind == DELETE:
+        deleted = set(tree.delete_many(keys))
+        if results is not None:
+            lines = [f"Deleted ({key})" if key in deleted else f"Not found {key} in tree." for key in keys]
+        summary["deleted"] += len(deleted)
+        summary["missing_deletes"] += len(keys) - len(deleted)
+    elif kind == SEARCH:
+        found = tree.search_many(keys)
+        for key in keys:
+            node, status = found[key]
+            if status == "found":
+                summary["found"] += 1
+                if results is not None:
+                    value = tree.read_from_main_file(node.offsets[bisect_left(node.keys, key)])
+                    lines.append(f"Found ({key}, {value})")
+            else:
+                summary["missing_searches"] += 1
+                lines.append(f"Not found {key} in tree.")
+    elif kind == DISPLAY:
+        summary["displayed"] += 1
+        if results is not None:
+            tree.display(offsets=False, file=results)
+    elif kind == UPDATE:
+        tree.delete_many(keys)
+        tree.insert_many((key, value) for _, _, key, value in batch)
+        summary["updated"] += len(batch)
+        lines = [f"Updated ({key}, {value})" for _, _, key, value in batch]
+    if results is not None:
+        for line in lines:
+            results.write(line + "\n")
@@ -0,0 +1,99 @@
+from btree import BTree
+
+# value keys and primary keys are packed into one 64-bit key of the index tree,
+# primary keys are shifted to be non-negative
+KEY_BITS = 32
+KEY_BIAS = 2 ** (KEY_BITS - 1)
+KEY_MASK = 2 ** KEY_BITS - 1
+
+
+def parse_list(value):
+    # elements of a "[1, 2, 3]" value or None
+    value = value.strip()
+    if not (value.startswith('[') and value.endswith(']')):
+        return None
+    try:
+        return [int(item) for item in value[1:-1].split(',') if item.strip()]
+    except ValueError:
+        return None
+
+
+def value_length(value):
+    # number of elements of a list value, characters of any other value
+    items = parse_list(value)
+    return len(items) if items is not None else len(value)
+
+
+def first_element(value):
+    # records without a first element are not indexed
+    items = parse_list(value)
+    return items[0] if items else None
+
+
+class SecondaryIndex:
+    # B-tree of (value key, primary key) pairs, the value key is derived from the record value
+    # by the extractor, many records may share it; kept in sync by the BTree it is added to
+    def __init__(self, name, extractor, index_path, t=None, page_size=None, codec="fixed", pool_capacity=128,
+                 layout="btree"):
+        self.name = name
+        self.extractor = extractor
+        self.tree = BTree(index_path=index_path, t=t, page_size=page_size, codec=codec, pool_capacity=pool_capacity,
+                          layout=layout)
+
+    @classmethod
+    def open(cls, name, extractor, index_path, pool_capacity=128):
+        # the extractor is not saved with the index and has to be the one it was built with
+        index = cls.__new__(cls)
+        index.name = name
+        index.extractor = extractor
+        index.tree = BTree.open(index_path, pool_capacity=pool_capacity)
+        return index
+
+    @staticmethod
+    def pack(value_key, key):
+        if not -KEY_BIAS <= value_key < KEY_BIAS or not -KEY_BIAS <= key < KEY_BIAS:
+            raise ValueError(f"Keys ({value_key}, {key}) do not fit in {KEY_BITS} bits")
+        return value_key << KEY_BITS | key + KEY_BIAS
+
+    @staticmethod
+    def unpack(packed):
+        return packed >> KEY_BITS, (packed & KEY_MASK) - KEY_BIAS
+
+    def add(self, key, value):
+        value_key = self.extractor(value)
+        if value_key is not None:
+            self.tree.insert(self.pack(value_key, key), 0, loading_file=True)
+
+    def remove(self, key, value):
+        value_key = self.extractor(value)
+        if value_key is not None:
+            self.tree.delete(self.pack(value_key, key))
+
+    def add_many(self, records):
+        # (key, value) pairs
+        pairs = []
+        for key, value in records:
+            value_key = self.extractor(value)
+            if value_key is not None:
+                pairs.append((self.pack(value_key, key), 0))
+        self.tree.insert_many(pairs, loading_file=True)
+
+    def rebuild(self, records):
+        # replaces the content of the index with the (key, value) pairs
+        tree = self.tree
+        tree.close()
+        self.tree = BTree(index_path=tree.index_path, t=tree.t, page_size=tree.pager.page_size, codec=tree.codec,
+                          pool_capacity=tree.buffer_pool.capacity, layout=tree.layout)
+        self.add_many(records)
+
+    def range(self, lo, hi):
+        # (value key, primary key) of every record with lo <= value key <= hi, in value key order
+        for packed, _ in self.tree.range(self.pack(lo, -KEY_BIAS), self.pack(hi, KEY_BIAS - 1)):
+            yield self.unpack(packed)
+
+    def lookup(self, value_key):
+        # primary keys of the records with the value key, in key order
+        return [key for _, key in self.range(value_key, value_key)]
+
+    def close(self):
+        self.tree.close()
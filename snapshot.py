@@ -0,0 +1,76 @@
+import os
+
+
+class Snapshot:
+    # read view of the tree as it was when the snapshot was taken, writers keep going:
+    # the writer copies a page into pages of every open snapshot before its first change,
+    # the copies are dropped with the snapshot
+    def __init__(self, tree):
+        self.tree = tree
+        self.root = tree.root
+        self.pages = {}
+        self.released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.tree.release_snapshot(self)
+            self.pages = {}
+
+    def read_node(self, node_index):
+        # copy of the page as the snapshot sees it, the page latch keeps the writer
+        # from changing it between the lookup and the copy
+        if self.released:
+            raise ValueError("Snapshot was released")
+        tree = self.tree
+        with tree._reading():
+            if tree.latches is not None:
+                tree.latches.acquire(node_index)
+            try:
+                node = self.pages.get(node_index)
+                if node is None:
+                    node = tree.read_node_from_drive(node_index).copy()
+            finally:
+                if tree.latches is not None:
+                    tree.latches.release(node_index)
+        return node
+
+    def search(self, key):
+        return self.tree._search_from(self.read_node(self.root), key, self.read_node)
+
+    def iter_from(self, key=None):
+        # (key, offset) pairs in key order starting at the first key >= key
+        for node, i in self.tree._iter_positions(key, self.root, self.read_node):
+            yield node.keys[i], node.offsets[i]
+
+    def range(self, lo, hi, include_values=False):
+        # deleted records keep their values in the data file, so they can still be read
+        for key, offset in self.iter_from(lo):
+            if key > hi:
+                return
+            if include_values:
+                yield key, self.tree.read_from_main_file(offset)
+            else:
+                yield key, offset
+
+    def traverse(self):
+        return [key for key, _ in self.iter_from()]
+
+    def display(self, offsets=True, file=None, level=0):
+        self.tree._display(self.read_node(self.root), level, offsets, file, self.read_node)
+
+    def export(self, path):
+        # writes the records as a "flag: key: value" text data file, returns their number
+        records = 0
+        with open(path + ".tmp", 'w') as file:
+            for key, offset in self.iter_from():
+                file.write(f"1: {key}: {self.tree.read_from_main_file(offset)}\n")
+                records += 1
+        os.replace(path + ".tmp", path)
+        return records
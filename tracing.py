@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import defaultdict
+
+# upper bounds of the latency buckets in microseconds, the last bucket is open
+BUCKETS_US = [2 ** i for i in range(21)]
+# end of a wrapped iterator
+DONE = object()
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS_US) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.buckets[min(len(BUCKETS_US), int(seconds * 1_000_000).bit_length())] += 1
+
+    def to_dict(self):
+        histogram = {}
+        for bound, count in zip(BUCKETS_US + [None], self.buckets):
+            if count:
+                histogram[f"<={bound}us" if bound is not None else f">{BUCKETS_US[-1]}us"] = count
+        return {"count": self.count, "seconds": self.seconds, "histogram": histogram}
+
+
+class Tracer:
+    # counters and timing histograms of internal events (split, compensate, merge,
+    # node and record I/O), each attributed to the top-level operation that caused it;
+    # passed to BTree(tracer=...), a tree without a tracer skips every hook
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.operations = defaultdict(Histogram)
+        self.events = defaultdict(Histogram)
+
+    def begin(self, operation):
+        # operations started by another one, like the search of insert_many, are not
+        # counted on their own and their events go to the outer operation
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append((operation, time.perf_counter()))
+
+    def end(self):
+        stack = self.local.stack
+        operation, start = stack.pop()
+        if not stack:
+            with self.lock:
+                self.operations[operation].add(time.perf_counter() - start)
+
+    def wrap(self, operation, iterator):
+        # lazy operation like a range, only the time spent producing its items is counted
+        stack = getattr(self.local, "stack", None)
+        top = not stack
+        seconds = 0.0
+        try:
+            while True:
+                self.begin(operation)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator, DONE)
+                finally:
+                    seconds += time.perf_counter() - start
+                    self.local.stack.pop()
+                if item is DONE:
+                    return
+                yield item
+        finally:
+            if top:
+                with self.lock:
+                    self.operations[operation].add(seconds)
+
+    def record(self, event, seconds):
+        # events outside of any operation are reported under "other"
+        stack = getattr(self.local, "stack", None)
+        operation = stack[0][0] if stack else "other"
+        with self.lock:
+            self.events[operation, event].add(seconds)
+
+    def report(self):
+        with self.lock:
+            report = {}
+            for operation, histogram in self.operations.items():
+                report[operation] = dict(histogram.to_dict(), events={})
+            for (operation, event), histogram in self.events.items():
+                report.setdefault(operation, {"events": {}})["events"][event] = histogram.to_dict()
+            return report
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+            self.events.clear()
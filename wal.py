@@ -0,0 +1,121 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from contextlib import nullcontext
+
+PAGE_RECORD = 1
+COMMIT_RECORD = 2
+# kind, page index, payload length, crc32 of the kind, index, length and payload
+RECORD_HEADER = struct.Struct("<BqII")
+
+
+class WriteAheadLog:
+    # redo log of page images, an operation is one group of page records closed by a
+    # commit record with tree metadata; commits are fsynced together every
+    # group_commit_ops operations, or group_commit_ms milliseconds after the first of them
+    def __init__(self, path, group_commit_ops=1, group_commit_ms=None, before_sync=None, thread_safe=False,
+                 keep=False):
+        self.path = path
+        # readers evicting pages and the group commit timer sync the log next to the committing writer
+        self.lock = threading.RLock() if thread_safe or group_commit_ms is not None else nullcontext()
+        self.before_sync = before_sync
+        self.group_commit_ops = group_commit_ops
+        self.group_commit_ms = group_commit_ms
+        # a recovered log keeps its records until the next checkpoint empties it
+        self.file = open(path, "ab" if keep else "wb")
+        self.buffer = bytearray()
+        self.size = self.file.tell()
+        self.pending_commits = 0
+        # syncs commits waiting for the rest of their group once group_commit_ms passes
+        self.timer = None
+        # counters
+        self.commits = 0
+        self.syncs = 0
+        self.bytes_written = 0
+
+    def commit(self, pages, metadata):
+        with self.lock:
+            for index, data in pages:
+                self._append(PAGE_RECORD, index, data)
+            self._append(COMMIT_RECORD, 0, json.dumps(metadata).encode())
+            self.commits += 1
+            self.pending_commits += 1
+            if self.pending_commits >= self.group_commit_ops:
+                self.sync()
+            elif self.group_commit_ms is not None and self.timer is None:
+                self.timer = threading.Timer(self.group_commit_ms / 1000, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def sync(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.buffer:
+                self.file.write(self.buffer)
+                self.buffer.clear()
+            if self.pending_commits:
+                if self.before_sync is not None:
+                    self.before_sync()
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.syncs += 1
+            self.pending_commits = 0
+
+    def truncate(self):
+        # called after a checkpoint, when every logged page is in the index file
+        with self.lock:
+            self.sync()
+            self.file.seek(0)
+            self.file.truncate()
+            self.size = 0
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.sync()
+                self.file.close()
+
+    def _append(self, kind, index, payload):
+        header = RECORD_HEADER.pack(kind, index, len(payload), 0)
+        crc = zlib.crc32(payload, zlib.crc32(header[:-4]))
+        self.buffer += RECORD_HEADER.pack(kind, index, len(payload), crc)
+        self.buffer += payload
+        self.size += RECORD_HEADER.size + len(payload)
+        self.bytes_written += RECORD_HEADER.size + len(payload)
+
+    @staticmethod
+    def recover(path, pager):
+        # writes pages of committed operations to the index file and returns the metadata
+        # of the last commit, a torn or incomplete tail is cut off
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+
+        metadata = None
+        pages = []
+        position = 0
+        committed = 0
+        while position + RECORD_HEADER.size <= len(data):
+            kind, index, length, crc = RECORD_HEADER.unpack_from(data, position)
+            start = position + RECORD_HEADER.size
+            payload = data[start:start + length]
+            header = RECORD_HEADER.pack(kind, index, length, 0)
+            if len(payload) != length or zlib.crc32(payload, zlib.crc32(header[:-4])) != crc:
+                break
+            if kind == PAGE_RECORD:
+                pages.append((index, payload))
+            elif kind == COMMIT_RECORD:
+                for page_index, page in pages:
+                    pager.write_page(page_index, page)
+                pages = []
+                metadata = json.loads(payload)
+                committed = start + length
+            position = start + length
+        if committed < len(data):
+            os.truncate(path, committed)
+        return metadata